@@ -0,0 +1,122 @@
+import struct
+from operator import itemgetter
+
+from codec import is_char, scalar_format
+from layout import is_bit_field, is_struct, is_union, layout_of, named_members
+
+# Record accessors read single fields straight out of a buffer (bytes,
+# bytearray, mmap, ...) through a memoryview. Field offsets and formats are
+# computed once when the accessor class is made, reading a field unpacks
+# only its own bytes.
+
+
+class RecordAccessor:
+    __slots__ = ('_buffer', '_offset')
+
+    # size of one record in bytes
+    _size = 0
+    # top-level scalar fields: name -> (byte offset, struct format)
+    _scalars = {}
+    _byte_order = '<'
+
+    def __init__(self, buffer, offset=0):
+        self._buffer = buffer if type(buffer) is memoryview else memoryview(buffer)
+        self._offset = offset
+
+    def __repr__(self):
+        return f'<{type(self).__name__} at {self._offset}>'
+
+    @classmethod
+    def iter_records(cls, buffer, stride=None, start=0):
+        """Accessors of consecutive records, `stride` bytes apart (the record
+        size by default)."""
+        buffer = memoryview(buffer)
+        stride = stride or cls._size
+        for offset in range(start, len(buffer) - cls._size + 1, stride):
+            yield cls(buffer, offset)
+
+    @classmethod
+    def iter_field(cls, buffer, name, start=0):
+        """Values of one top-level scalar field of every record, decoded by
+        struct.iter_unpack without creating accessors."""
+        offset, format = cls._scalars[name]
+        padding = cls._size - offset - struct.calcsize(cls._byte_order + format)
+        record = struct.Struct(f'{cls._byte_order}{offset}x{format}{padding}x')
+        buffer = memoryview(buffer)[start:]
+        count = len(buffer) // cls._size
+        return map(itemgetter(0), record.iter_unpack(buffer[:count * cls._size]))
+
+
+def make_accessor(type_desc, name='Record', byte_order='<'):
+    """Accessor class of a simplified struct or union with one read-only
+    property per field (members of anonymous structs and unions included).
+    Nested structs and unions are accessors themselves, arrays are tuples
+    (character arrays are memoryview slices)."""
+    layout = layout_of(type_desc)
+    namespace = {
+        '__slots__': (),
+        '_size': layout['size'] // 8,
+        '_scalars': {},
+        '_byte_order': byte_order,
+    }
+    for field_name, field_desc in named_members(type_desc):
+        offset = layout['offsets'][field_name]
+        namespace[field_name] = field_property(
+            field_name, field_desc, offset, f'{name}_{field_name}', byte_order, namespace['_scalars'])
+    return type(name, (RecordAccessor,), namespace)
+
+
+def field_property(field_name, field_desc, offset, class_name, byte_order, scalars):
+    if is_bit_field(field_desc):
+        return property(bit_field_getter(field_desc, offset, byte_order))
+
+    start = offset // 8
+    if is_struct(field_desc) or is_union(field_desc):
+        nested = make_accessor(field_desc, class_name, byte_order)
+        return property(lambda self: nested(self._buffer, self._offset + start))
+
+    if field_desc['type'] != 'array':
+        format = scalar_format(field_desc, field_name)
+        unpack_from = struct.Struct(byte_order + format).unpack_from
+        if len(format) > 1 and not format.endswith('s'):
+            # complex numbers are stored as (real, imaginary)
+            return property(lambda self: complex(*unpack_from(self._buffer, self._offset + start)))
+        scalars[field_name] = (start, format)
+        return property(lambda self: unpack_from(self._buffer, self._offset + start)[0])
+
+    element = field_desc['element_def']
+    count = field_desc['element_count']
+    if count is None:
+        raise ValueError(f'Element count of "{field_name}" is unknown')
+
+    if is_struct(element) or is_union(element):
+        nested = make_accessor(element, class_name, byte_order)
+        stride = field_desc['stride'] // 8
+        return property(lambda self: tuple(
+            nested(self._buffer, self._offset + start + index * stride) for index in range(count)))
+
+    if is_char(element):
+        return property(lambda self: self._buffer[self._offset + start:self._offset + start + count])
+
+    unpack_from = struct.Struct(byte_order + scalar_format(element, field_name) * count).unpack_from
+    return property(lambda self: unpack_from(self._buffer, self._offset + start))
+
+
+def bit_field_getter(field_desc, offset, byte_order):
+    # the storage unit is read as one integer, the field is a single
+    # mask and shift of it (see layout.add_bit_field_masks)
+    bits = field_desc['size']
+    shift = field_desc['shift']
+    start = (offset - shift) // 8
+    end = start + field_desc['storage_size'] // 8
+    order = 'big' if byte_order in ('>', '!') else 'little'
+    if order == 'big':
+        shift = field_desc['storage_size'] - shift - bits
+    mask = ((1 << bits) - 1) << shift
+    sign = 1 << (bits - 1) if field_desc['signed'] else 0
+
+    def get(self):
+        unit = int.from_bytes(self._buffer[self._offset + start:self._offset + end], order)
+        return ((unit & mask) >> shift ^ sign) - sign
+
+    return get
@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import par
+
+# Asynchronous front end of par.map_source for event-loop based services.
+# Parsing runs in a pool of worker processes (the parser keeps its types in
+# module state and holds the GIL), identical sources that are being mapped
+# share one job, and at most `max_pending` jobs are submitted at a time.
+
+max_workers = None  # one worker per CPU
+max_pending = 64
+
+executor = None
+# semaphores and futures belong to one event loop, each loop running the
+# mapper gets its own (pending semaphore, in-flight jobs)
+loop_states = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    return executor
+
+
+def loop_state():
+    loop = asyncio.get_running_loop()
+    state = loop_states.get(loop)
+    if state is None:
+        state = loop_states[loop] = (asyncio.Semaphore(max_pending), {})
+    return state
+
+
+def finished(key):
+    loop = asyncio.get_running_loop()
+    pending, in_flight = loop_states[loop]
+    in_flight.pop(key, None)
+    # the semaphore refers to its loop and would keep the weak key alive
+    if not in_flight:
+        del loop_states[loop]
+
+
+def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+
+async def map_source(data, abi='lp64'):
+    """Simplified types of every struct in a C source, their function pointer
+    signatures and the problems found (see par.map_source). Callers mapping
+    the same source at the same time receive the same result object."""
+    key = hashlib.sha256(f'{abi}\0{data}'.encode()).hexdigest()
+    pending, in_flight = loop_state()
+    job = in_flight.get(key)
+    if job is None:
+        job = asyncio.ensure_future(run(data, abi, pending))
+        in_flight[key] = job
+        job.add_done_callback(lambda _: finished(key))
+    # one caller giving up must not cancel the job of the others
+    return await asyncio.shield(job)
+
+
+async def run(data, abi, pending):
+    async with pending:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), par.map_source, data, abi)
@@ -0,0 +1,108 @@
+import argparse
+import re
+
+import diagnostics
+import output
+import par
+import parallel
+
+# Maps huge sources without holding them in memory. The file is read in
+# blocks of whole lines and split after a ";" outside of braces, comments
+# and literals, i.e. between top-level declarations. The chunks are parsed
+# one after another into the same registry (later chunks need the typedef
+# names of earlier ones). The syntax trees of a chunk are dropped once its
+# types are simplified, so only those of one chunk are kept at a time. With
+# workers the trees of the types are kept until the pool simplifies them.
+
+chunk_size = 1 << 20  # characters
+
+boundaries = re.compile(r'''//[^\n]*|/\*|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|[{};]''')
+
+
+def declaration_chunks(file, size=chunk_size):
+    """(first line, text) of consecutive parts of a text file of at least
+    `size` characters that end between two top-level declarations."""
+    depth = 0
+    in_comment = False
+    pending = ''
+    line = 1
+    while True:
+        block = ''.join(file.readlines(size))
+        if not block:
+            break
+
+        cut = None
+        position = 0
+        while position < len(block):
+            if in_comment:
+                end = block.find('*/', position)
+                if end < 0:
+                    break
+                in_comment = False
+                position = end + 2
+                continue
+
+            match = boundaries.search(block, position)
+            if match is None:
+                break
+            token = match.group()
+            if token == '/*':
+                in_comment = True
+            elif token == '{':
+                depth += 1
+            elif token == '}':
+                depth -= 1
+            elif token == ';' and depth <= 0:
+                cut = match.end()
+            position = match.end()
+
+        if cut is None or len(pending) + cut < size:
+            pending += block
+            continue
+        chunk = pending + block[:cut]
+        yield line, chunk
+        line += chunk.count('\n')
+        pending = block[cut:]
+
+    if pending.strip():
+        yield line, pending
+
+
+def map_file(path, abi='lp64', size=chunk_size, max_workers=None):
+    """Like par.map_source for a file that is parsed in chunks. With
+    `max_workers` the types are simplified in a process pool once every
+    chunk is parsed (see parallel.simplify_deferred)."""
+    par.reset()
+    if par.size_lookup is None:
+        par.load_size_lookup()
+    par.load_prelude(abi)
+
+    par.lazy = max_workers is not None
+    try:
+        with open(path, 'r') as file:
+            for line, chunk in declaration_chunks(file, size):
+                par.parse_source(chunk, path, line)
+                if not par.lazy:
+                    # only needed to simplify the types again (par.resimplify)
+                    for kind in par.registered.values():
+                        kind.clear()
+    finally:
+        par.lazy = False
+
+    if max_workers is not None:
+        parallel.simplify_deferred(max_workers)
+    return dict(par.simplified_types), list(par.signatures), diagnostics.entries()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Map a large C source chunk by chunk')
+    arguments.add_argument('path')
+    arguments.add_argument('--output', default='result.json')
+    arguments.add_argument('--abi', default='lp64')
+    arguments.add_argument('--chunk-size', type=int, default=chunk_size, help='characters per chunk')
+    arguments.add_argument('--workers', type=int, help='simplify types in this many processes')
+    options = arguments.parse_args()
+
+    types, _, _ = map_file(options.path, options.abi, options.chunk_size, options.workers)
+    output.dump(types, options.output)
+    diagnostics.render()
@@ -0,0 +1,283 @@
+import struct
+
+from layout import is_anonymous, is_bit_field, is_pointer, is_struct, is_union, is_unnamed, layout_of
+
+# Compiles simplified struct descriptions into struct.Struct codecs.
+# Nested structs and arrays are flattened ahead of time and padding is
+# written explicitly from the computed layout, so decoding a record is a
+# single unpack_from call. Bit-fields are read as the bytes holding them and
+# split with generated shift/mask expressions. Unions are decoded as bytes,
+# their members overlap.
+
+integer_formats = {8: 'b', 16: 'h', 32: 'i', 64: 'q'}
+float_formats = {32: 'f', 64: 'd'}
+unit_formats = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+class Codec:
+    def __init__(self, format, names, expand, collapse):
+        self.struct = struct.Struct(format)
+        self.format = format
+        self.names = names
+        self.size = self.struct.size
+
+        if expand is None:
+            self.unpack_from = self.struct.unpack_from
+            self.iter_unpack = self.struct.iter_unpack
+            self.pack = self.struct.pack
+            self.pack_into = self.struct.pack_into
+        else:
+            unpack_from = self.struct.unpack_from
+            iter_unpack = self.struct.iter_unpack
+            pack = self.struct.pack
+            pack_into = self.struct.pack_into
+            self.unpack_from = lambda buffer, offset=0: expand(unpack_from(buffer, offset))
+            self.iter_unpack = lambda buffer: map(expand, iter_unpack(buffer))
+            self.pack = lambda *values: pack(*collapse(values))
+            self.pack_into = lambda buffer, offset, *values: pack_into(buffer, offset, *collapse(values))
+
+    def unpack_dict(self, buffer, offset=0):
+        return dict(zip(self.names, self.unpack_from(buffer, offset)))
+
+
+def compile_codec(type_desc, byte_order='<'):
+    """Codec of a simplified struct. Values are flat tuples in the order of
+    codec.names (nested fields are named "outer.inner", array elements
+    "name[index]" with the index of the flattened array)."""
+    items = []
+    flatten_struct(type_desc, 0, '', items)
+    items.sort(key=lambda item: item['offset'])
+
+    # bit-fields are read as runs of the bytes holding them: a storage unit
+    # may also hold plain members placed between its bit-fields (SysV), or
+    # share bytes with the unit of a bit-field of another type
+    runs = {}
+    run = None
+    for item in items:
+        if item['kind'] != 'bit_field':
+            continue
+        start = item['offset'] // 8
+        end = -(-(item['offset'] + item['bits']) // 8)
+        if run is None or start > run['end']:
+            run = {
+                'kind': 'unit',
+                'offset': start * 8,
+                'end': end,
+                'bit_fields': []
+            }
+        run['end'] = max(run['end'], end)
+        run['bit_fields'].append(item)
+        runs[id(item)] = run
+
+    for run in runs.values():
+        run['byte_count'] = run['end'] - run['offset'] // 8
+        run['format'] = unit_formats.get(run['byte_count'], f'{run["byte_count"]}s')
+
+    format = byte_order
+    position = 0
+    raw = []
+    for item in items:
+        if item['kind'] == 'bit_field':
+            item = runs[id(item)]
+            if raw and raw[-1] is item:
+                continue
+        start = item['offset'] // 8
+        if start < position:
+            name = item['names'][0] if 'names' in item else item['bit_fields'][0]['names'][0]
+            raise ValueError(f'Field "{name}" overlaps the bytes of the previous field')
+        if start > position:
+            format += f'{start - position}x'
+        format += item['format']
+        position = start + struct.calcsize(byte_order + item['format'])
+        raw.append(item)
+
+    size = layout_of(type_desc)['size'] // 8
+    if size > position:
+        format += f'{size - position}x'
+
+    names = []
+    for item in items:
+        names.extend(item['names'])
+
+    if not any(item['kind'] == 'unit' for item in raw):
+        return Codec(format, names, None, None)
+
+    expand, collapse = generate_bit_field_code(raw, names, byte_order)
+    return Codec(format, names, expand, collapse)
+
+
+def flatten_struct(type_desc, base, prefix, items):
+    offsets = layout_of(type_desc)['offsets']
+    for name, field_desc in type_desc.items():
+        if is_unnamed(name):
+            continue
+        if is_anonymous(name) and is_struct(field_desc):
+            # the members of an anonymous struct are fields of the parent
+            flatten_struct(field_desc, base + offsets[name], prefix, items)
+            continue
+        flatten_field(field_desc, base + offsets[name], prefix + name, items)
+
+
+def flatten_field(field_desc, offset, name, items):
+    if is_bit_field(field_desc):
+        items.append({
+            'kind': 'bit_field',
+            'offset': offset,
+            'unit_offset': offset - field_desc['shift'],
+            'bits': field_desc['size'],
+            'signed': field_desc['signed'],
+            'names': [name]
+        })
+        return
+
+    if is_struct(field_desc):
+        flatten_struct(field_desc, offset, name + '.', items)
+        return
+
+    if is_union(field_desc):
+        items.append(union_item(field_desc, offset, name))
+        return
+
+    if field_desc['type'] != 'array':
+        items.append({
+            'kind': 'value',
+            'offset': offset,
+            'format': scalar_format(field_desc, name),
+            'names': scalar_names(field_desc, name)
+        })
+        return
+
+    element = field_desc['element_def']
+    count = field_desc['element_count']
+    if count is None:
+        raise ValueError(f'Element count of "{name}" is unknown')
+
+    if is_struct(element):
+        for index in range(count):
+            flatten_struct(element, offset + index * field_desc['stride'], f'{name}[{index}].', items)
+        return
+
+    if is_union(element):
+        for index in range(count):
+            items.append(union_item(element, offset + index * field_desc['stride'], f'{name}[{index}]'))
+        return
+
+    if is_char(element):
+        # character arrays are decoded as one bytes value
+        items.append({
+            'kind': 'value',
+            'offset': offset,
+            'format': f'{count}s',
+            'names': [name]
+        })
+        return
+
+    element_format = scalar_format(element, name)
+    element_names = scalar_names(element, name)
+    names = []
+    for index in range(count):
+        names.extend(n.replace(name, f'{name}[{index}]', 1) for n in element_names)
+    items.append({
+        'kind': 'value',
+        'offset': offset,
+        'format': element_format * count if len(element_format) > 1 else f'{count}{element_format}',
+        'names': names
+    })
+
+
+def union_item(type_desc, offset, name):
+    # the members overlap, a union is decoded as its raw bytes
+    size = type_desc['size']
+    if type(size) is not int:
+        raise ValueError(f'Size of "{name}" is unknown')
+    return {
+        'kind': 'value',
+        'offset': offset,
+        'format': f'{size // 8}s',
+        'names': [name]
+    }
+
+
+def is_char(type_desc):
+    return not is_struct(type_desc) and not is_pointer(type_desc) and 'char' in type_desc['type'].split()
+
+
+def scalar_format(type_desc, name):
+    size = type_desc['size']
+    if type(size) is not int:
+        raise ValueError(f'Size of "{name}" is unknown')
+
+    if is_pointer(type_desc):
+        return integer_formats[size].upper()
+
+    words = type_desc['type'].split()
+    if type_desc['type'].startswith('complex'):
+        return float_formats[size // 2] * 2
+    if 'float' in words or 'double' in words:
+        if size not in float_formats:
+            # long double has no struct format, keep the raw bytes
+            return f'{size // 8}s'
+        return float_formats[size]
+    if '_Bool' in words:
+        return '?'
+    if 'unsigned' in words:
+        return integer_formats[size].upper()
+    return integer_formats[size]
+
+
+def scalar_names(type_desc, name):
+    if not is_pointer(type_desc) and type_desc['type'].startswith('complex'):
+        return [f'{name}.real', f'{name}.imag']
+    return [name]
+
+
+def generate_bit_field_code(raw, names, byte_order):
+    """Source of the functions converting between struct values (bit-field
+    storage units) and field values, one expression per field."""
+    positions = {name: position for position, name in enumerate(names)}
+    field_values = {}
+    unit_values = []
+    index = 0
+    for item in raw:
+        if item['kind'] != 'unit':
+            for name in item['names']:
+                field_values[name] = f'raw[{index}]'
+                unit_values.append(f'values[{positions[name]}]')
+                index += 1
+            continue
+
+        unit_bits = item['byte_count'] * 8
+        order = 'big' if byte_order in ('>', '!') else 'little'
+        unit = f'raw[{index}]'
+        if item['format'].endswith('s'):
+            unit = f'int.from_bytes(raw[{index}], "{order}")'
+
+        parts = []
+        for bit_field in item['bit_fields']:
+            shift = bit_field['offset'] - item['offset']
+            if order == 'big':
+                shift = unit_bits - shift - bit_field['bits']
+            mask = (1 << bit_field['bits']) - 1
+            expression = f'({unit} >> {shift} & {mask:#x})'
+            if bit_field['signed']:
+                sign = 1 << (bit_field['bits'] - 1)
+                expression = f'({expression} ^ {sign:#x}) - {sign:#x}'
+            field_values[bit_field['names'][0]] = expression
+            parts.append(f'(values[{positions[bit_field["names"][0]]}] & {mask:#x}) << {shift}')
+
+        combined = ' | '.join(parts)
+        if item['format'].endswith('s'):
+            combined = f'({combined}).to_bytes({item["byte_count"]}, "{order}")'
+        unit_values.append(combined)
+        index += 1
+
+    source = (
+        'def expand(raw):\n'
+        f'    return ({", ".join(field_values[name] for name in names)},)\n'
+        '\n'
+        'def collapse(values):\n'
+        f'    return ({", ".join(unit_values)},)\n'
+    )
+    namespace = {}
+    exec(source, namespace)
+    return namespace['expand'], namespace['collapse']
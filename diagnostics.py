@@ -0,0 +1,62 @@
+import sys
+
+# Problems found while mapping. They are collected instead of printed as
+# they happen: a problem seen again (the same missing type in every field
+# using it) only increases the count of the first report, and everything is
+# rendered at once when mapping is done. Problems reported as located (a
+# declaration skipped after a syntax error) are kept once per location.
+
+severities = ('error', 'warning')
+
+# (severity, message) or, for located problems, (severity, message, file,
+# line) -> {'severity', 'message', 'file', 'line', 'count'}
+collected = {}
+
+
+def report(severity, message, file=None, line=None, count=1, located=False):
+    key = (severity, message, file, line) if located else (severity, message)
+    entry = collected.get(key)
+    if entry is None:
+        collected[key] = {
+            'severity': severity,
+            'message': message,
+            'file': file,
+            'line': line,
+            'count': count
+        }
+    else:
+        entry['count'] += count
+
+
+def merge(entries):
+    """Add problems collected elsewhere (e.g. in a worker process)."""
+    for entry in entries:
+        report(entry['severity'], entry['message'], entry['file'], entry['line'], entry['count'])
+
+
+def clear():
+    collected.clear()
+
+
+def entries():
+    """Collected problems, errors first, each in the order of its first report."""
+    return sorted(collected.values(), key=lambda entry: severities.index(entry['severity']))
+
+
+def count(severity):
+    return sum(1 for entry in collected.values() if entry['severity'] == severity)
+
+
+def format_entry(entry):
+    location = ':'.join(str(part) for part in (entry['file'], entry['line']) if part is not None)
+    text = f"{entry['severity']}: {entry['message']}"
+    if location:
+        text = f'{location}: {text}'
+    if entry['count'] > 1:
+        text += f" ({entry['count']} times)"
+    return text
+
+
+def render(file=sys.stderr):
+    if collected:
+        file.write(''.join(format_entry(entry) + '\n' for entry in entries()))
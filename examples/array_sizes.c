@@ -0,0 +1,13 @@
+enum { N = 8 };
+
+struct hdr {
+    char tag;
+    int length;
+};
+
+struct buffer {
+    struct hdr header;
+    int buf[N * 4 + sizeof(struct hdr)];
+    char names[sizeof(int *) << 1];
+    unsigned char data[];
+};
@@ -0,0 +1,8 @@
+typedef unsigned char row_t[4];
+
+struct tables {
+    unsigned char lut[256][16][4];
+    row_t rows[8];
+    int *pointers[2];
+    void (*handlers[3])(int);
+};
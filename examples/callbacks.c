@@ -0,0 +1,18 @@
+struct buffer;
+
+typedef void (*release_fn)(void *);
+
+struct file_operations {
+    long (*read)(struct buffer *, char *, unsigned long, long *);
+    long (*write)(struct buffer *, const char *, unsigned long, long *);
+    int (*open)(struct buffer *buffer, int flags);
+    int (*release)(struct buffer *buffer, int flags);
+    int (*printf)(const char *format, ...);
+    void (*on_error)(void);
+    char *(*name)(int);
+    void (*handlers[4])(int signal);
+    void (*visit)(void (*callback)(int), int values[8]);
+    int (*(*lookup)(const char *name))(struct buffer *);
+    release_fn free;
+    release_fn free_data;
+};
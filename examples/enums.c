@@ -0,0 +1,15 @@
+enum flags {
+    FLAG_NONE,
+    FLAG_READ = 1 << 0,
+    FLAG_WRITE = 1 << 1,
+    FLAG_RW = FLAG_READ | FLAG_WRITE,
+    FLAG_MASK = FLAG_RW << 3 | 0x7,
+    FLAG_NEXT,
+};
+
+enum { LETTER = 'A', NEGATIVE = -7 / 2, ODD = NEGATIVE % 2 };
+
+struct file {
+    enum flags mode;
+    int fd;
+};
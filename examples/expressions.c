@@ -0,0 +1,12 @@
+enum masks {
+    MODE_SHIFT = (1 << 3) | 2,
+    MODE_MASK = (0x7 << MODE_SHIFT),
+    HALF = ~0u >> 1,
+    TAG = 'ab',
+};
+
+struct table {
+    int cells[(2 + 3) * 4];
+    char header[(sizeof(int) + 1) * 2];
+    unsigned char wrapped[(unsigned char)(256 + 3)];
+};
@@ -0,0 +1,25 @@
+typedef struct node node_t;
+
+struct node {
+    int value;
+    struct node *next;
+    struct node *prev;
+    node_t **children;
+};
+
+struct list {
+    struct node *head;
+    node_t *tail;
+    const char *name;
+    char *const *labels;
+    struct list *parent;
+    unsigned long length;
+};
+
+typedef struct tree *tree_ptr;
+
+struct tree {
+    tree_ptr left;
+    tree_ptr right;
+    void *payload;
+};
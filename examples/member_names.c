@@ -0,0 +1,13 @@
+struct marker {
+    int bit_field;
+    int is_pointer;
+    char type;
+    short size;
+};
+
+struct wrapper {
+    struct marker inner;
+    struct marker list[2];
+    char tail;
+    unsigned flags : 3;
+};
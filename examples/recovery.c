@@ -0,0 +1,27 @@
+struct before {
+    int x;
+};
+
+struct packed {
+    char c;
+    int i;
+} __attribute__((packed));
+
+__declspec(align(16)) struct aligned {
+    double d;
+};
+
+struct with_attribute {
+    int x __attribute__((aligned(8)));
+    int y;
+};
+
+static inline int add(int a, int b) {
+    __asm__ volatile ("nop");
+    return a + b;
+}
+
+struct after {
+    struct before b;
+    char tail;
+};
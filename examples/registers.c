@@ -0,0 +1,24 @@
+struct status {
+    unsigned int ready : 1;
+    unsigned int mode : 3;
+    int offset : 4;
+    unsigned short counter;
+};
+
+struct frame {
+    char name[6];
+    struct status status;
+    double values[2];
+    uint8_t tail;
+};
+
+struct control {
+    uint32_t enable : 1;
+    uint32_t : 3;
+    uint32_t prescaler : 4;
+    uint32_t : 0;
+    uint32_t irq : 1;
+    _Bool pending : 1;
+    _Bool masked : 1;
+    _Bool busy;
+};
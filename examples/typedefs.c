@@ -0,0 +1,16 @@
+typedef unsigned int uint32_t;
+typedef unsigned char uint8_t;
+typedef void (*handler_t)(int);
+
+typedef struct {
+    uint32_t id;
+    uint8_t flags;
+} header_t;
+
+struct packet {
+    header_t header;
+    const uint8_t *payload;
+    uint32_t length;
+    handler_t on_done;
+    int integer_value;
+};
@@ -0,0 +1,38 @@
+union value {
+    int i;
+    double d;
+    char bytes[12];
+};
+
+struct tagged {
+    int kind;
+    union value value;
+};
+
+struct packet {
+    unsigned char type;
+    union {
+        struct {
+            unsigned short source;
+            unsigned short destination;
+        };
+        unsigned int route;
+    };
+    union {
+        unsigned int raw;
+        struct {
+            unsigned int low : 12;
+            unsigned int high : 20;
+        };
+    } control;
+};
+
+typedef union {
+    float f;
+    unsigned int bits;
+} float_bits;
+
+struct uses_typedef {
+    char c;
+    float_bits fb;
+};
@@ -0,0 +1,248 @@
+from builtins import id as object_id
+
+# Memory layout of simplified types. Sizes, alignments and offsets are in
+# bits, like the sizes in lookup.json.
+
+layout_cache = {}
+
+# Bit-field allocation rules of the ABI (see par.load_prelude):
+# - 'sysv' (GCC, Clang): a bit-field continues at the next free bit unless
+#   it would cross a boundary of its storage unit, "int : 0" moves to the
+#   next unit boundary, unnamed bit-fields do not align the struct
+# - 'msvc': consecutive bit-fields share a storage unit only if their types
+#   have the same size and they fit, the next field starts after the unit,
+#   ": 0" closes the unit (and is ignored after a field that is not a
+#   bit-field)
+bit_field_rules = 'sysv'
+
+
+def align_to(offset, align):
+    return -(-offset // align) * align
+
+
+def is_pointer(type_desc):
+    # the markers are booleans, a struct may have members of the same names
+    return type_desc.get('is_pointer') is True
+
+
+def is_bit_field(type_desc):
+    return type_desc.get('bit_field') is True
+
+
+def is_struct(type_desc):
+    # structs are dictionaries of their fields, every other type has a name
+    return not is_pointer(type_desc) and type(type_desc.get('type')) is not str
+
+
+def is_union(type_desc):
+    return not is_pointer(type_desc) and type_desc.get('type') == 'union'
+
+
+def is_anonymous(name):
+    # anonymous struct and union members are stored under "(anonymous N)"
+    return name.startswith('(anonymous')
+
+
+def is_unnamed(name):
+    # unnamed bit-fields (padding, ": 0") are stored under "(unnamed N)"
+    return name.startswith('(unnamed')
+
+
+def members(type_desc):
+    """Fields of a struct or members of a union."""
+    return type_desc['members'] if is_union(type_desc) else type_desc
+
+
+def named_members(type_desc):
+    """(name, description) of the members of a struct or union, with the
+    members of anonymous structs and unions in place of them."""
+    for name, member in members(type_desc).items():
+        if is_anonymous(name):
+            yield from named_members(member)
+        elif not is_unnamed(name):
+            yield name, member
+
+
+def type_layout(type_desc):
+    """Size and alignment of a simplified type, (None, None) when the size
+    of some part is unknown."""
+    layout = layout_of(type_desc)
+    return layout['size'], layout['align']
+
+
+def layout_of(type_desc):
+    """Size, alignment and field offsets of a simplified type. Results are
+    cached per description, so a struct used in many places is laid out
+    once."""
+    cached = layout_cache.get(object_id(type_desc))
+    if cached is not None and cached[0] is type_desc:
+        return cached[1]
+    layout = compute_layout(type_desc)
+    # the description is kept alive so its id is not reused, until forget
+    layout_cache[object_id(type_desc)] = (type_desc, layout)
+    return layout
+
+
+def forget(type_desc, seen=None):
+    """Drop the cached layouts of a description and of the descriptions in
+    it, once it is replaced or removed (see par.resimplify)."""
+    if seen is None:
+        seen = set()
+    if type(type_desc) is not dict or object_id(type_desc) in seen:
+        return
+    seen.add(object_id(type_desc))
+    cached = layout_cache.get(object_id(type_desc))
+    if cached is not None and cached[0] is type_desc:
+        del layout_cache[object_id(type_desc)]
+    for child in type_desc.values():
+        forget(child, seen)
+
+
+def unknown_layout():
+    return {
+        'size': None,
+        'align': None,
+        'offsets': {},
+        'units': {}
+    }
+
+
+def compute_layout(type_desc):
+    if is_union(type_desc):
+        return union_layout(type_desc['members'])
+
+    if not is_struct(type_desc):
+        if type_desc['type'] == 'array':
+            _, align = type_layout(type_desc['element_def'])
+            size = type_desc['size']
+        else:
+            size = type_desc['size']
+            if type(size) is not int:
+                return unknown_layout()
+            align = size // 2 if type_desc['type'].startswith('complex') else size
+        return {
+            'size': size,
+            'align': max(align, 8) if align is not None else None,
+            'offsets': {},
+            'units': {}
+        }
+
+    offset = 0
+    struct_align = 8
+    offsets = {}
+    # bit-field name -> offset of its storage unit
+    units = {}
+    # (offset, size) of the storage unit open under the msvc rules
+    unit = None
+    for name, field_desc in type_desc.items():
+        if is_bit_field(field_desc):
+            bits = field_desc['size']
+            unit_size = field_desc['storage_size']
+            if type(bits) is not int or type(unit_size) is not int:
+                return unknown_layout()
+            if bit_field_rules == 'msvc':
+                if bits == 0 or unit is None or unit[1] != unit_size or offset + bits > unit[0] + unit_size:
+                    if bits > 0 or unit is not None:
+                        if unit is not None:
+                            offset = unit[0] + unit[1]
+                        offset = align_to(offset, unit_size)
+                        struct_align = max(struct_align, unit_size)
+                    unit = (offset, unit_size) if bits > 0 else None
+                start = unit[0] if unit is not None else offset
+            else:
+                # a bit-field continues in the current storage unit when it
+                # fits, otherwise it starts at the next one
+                if bits == 0 or offset // unit_size != (offset + bits - 1) // unit_size:
+                    offset = align_to(offset, unit_size)
+                start = offset - offset % unit_size
+                if not is_unnamed(name):
+                    struct_align = max(struct_align, unit_size)
+            offsets[name] = offset
+            units[name] = start
+            offset += bits
+            continue
+
+        if unit is not None:
+            # the field after msvc bit-fields starts after their unit
+            offset = unit[0] + unit[1]
+            unit = None
+        field_layout = layout_of(field_desc)
+        size, align = field_layout['size'], field_layout['align']
+        if size is None:
+            return unknown_layout()
+        offset = align_to(offset, align)
+        offsets[name] = offset
+        if is_anonymous(name):
+            add_members(offsets, field_layout, offset)
+            add_members(units, {'offsets': field_layout['units']}, offset)
+        offset += size
+        struct_align = max(struct_align, align)
+
+    if unit is not None:
+        offset = unit[0] + unit[1]
+    return {
+        'size': align_to(offset, struct_align),
+        'align': struct_align,
+        'offsets': offsets,
+        'units': units
+    }
+
+
+def union_layout(union_members):
+    # every member starts at the beginning of the union
+    size = 0
+    union_align = 8
+    offsets = {}
+    units = {}
+    for name, member in union_members.items():
+        offsets[name] = 0
+        if is_bit_field(member):
+            if type(member['size']) is not int or type(member['storage_size']) is not int:
+                return unknown_layout()
+            units[name] = 0
+            if bit_field_rules == 'msvc' and member['size']:
+                size = max(size, member['storage_size'])
+            else:
+                size = max(size, member['size'])
+            if not is_unnamed(name):
+                union_align = max(union_align, member['storage_size'])
+            continue
+
+        member_layout = layout_of(member)
+        if member_layout['size'] is None:
+            return unknown_layout()
+        if is_anonymous(name):
+            add_members(offsets, member_layout, 0)
+            add_members(units, {'offsets': member_layout['units']}, 0)
+        size = max(size, member_layout['size'])
+        union_align = max(union_align, member_layout['align'])
+
+    return {
+        'size': align_to(size, union_align),
+        'align': union_align,
+        'offsets': offsets,
+        'units': units
+    }
+
+
+def add_members(offsets, member_layout, offset):
+    # members of anonymous structs and unions are addressed like fields of
+    # the enclosing type
+    for name, member_offset in member_layout['offsets'].items():
+        if not is_anonymous(name) and not is_unnamed(name):
+            offsets[name] = offset + member_offset
+
+
+def add_bit_field_masks(type_desc):
+    """Store the position of every bit-field of a struct or union in its
+    description: `bit_offset` and `storage_offset` (of its storage unit)
+    from the start of the type, and the `shift` and `mask` that extract it
+    from the storage unit read as an integer, lowest bit first."""
+    layout = layout_of(type_desc)
+    for name, member in members(type_desc).items():
+        if not is_bit_field(member) or name not in layout['offsets']:
+            continue
+        member['bit_offset'] = layout['offsets'][name]
+        member['storage_offset'] = layout['units'][name]
+        member['shift'] = member['bit_offset'] - member['storage_offset']
+        member['mask'] = ((1 << member['size']) - 1) << member['shift']
@@ -1,5 +1,7 @@
 from sly import Lexer
 
+import diagnostics
+
 oct = r'[0-7]'
 dec = r'[0-9]'
 non_zero = r'[1-9]'
@@ -10,12 +12,71 @@ hex_prefix = r'(0[xX])'
 exponent = fr'([Ee][+-]?{dec}+)'
 hex_exponent = fr'([Pp][+-]?{dec}+)'
 float_suffix = r'(f|F|l|L)'
-int_suffix = r'(((u|U)(l|L|ll|LL)?)|((l|L|ll|LL)(u|U)?))'
+int_suffix = r'(((u|U)(ll|LL|l|L)?)|((ll|LL|l|L)(u|U)?))'
 char_prefix = r'(u|U|L)'
 string_prefix = r'(u8|u|U|L)'
 escaped = r'(\\([\'"\?\\abfnrtv]|[0-7]{1,3}|x[a-fA-F0-9]+))'
 whitespace = r'[ \t\v\n\f]'
 
+# Names declared with "typedef" so far. The parser adds to it as it reduces
+# typedef declarations and the lexer reports those names as TYPEDEF_NAME
+# where they name a type (see DeclarationContext).
+typedef_names = set()
+
+type_specifiers = {
+    'VOID', 'CHAR', 'SHORT', 'INT', 'LONG', 'FLOAT', 'DOUBLE', 'SIGNED',
+    'UNSIGNED', 'BOOL', 'COMPLEX', 'IMAGINARY', 'TYPEDEF_NAME',
+    'STRUCT', 'UNION', 'ENUM',
+}
+
+tags = {'STRUCT', 'UNION', 'ENUM'}
+
+
+class DeclarationContext:
+    """Decides whether a typedef name is a type or a name being declared.
+    Once the specifiers of a declaration have a type ("int count;",
+    "node *node;") a typedef name is declared again, in expressions (array
+    sizes, casts, sizeof) it is always a type, and after struct, union or
+    enum it is a tag."""
+
+    def __init__(self):
+        # per nesting level: [type seen, parameter list, in an expression]
+        self.frames = [[False, False, False]]
+        self.previous = None
+
+    def name_type(self, name):
+        if name not in typedef_names or self.previous in tags:
+            return 'ID'
+        typed, _, expression = self.frames[-1]
+        return 'TYPEDEF_NAME' if expression or not typed else 'ID'
+
+    def advance(self, token_type):
+        frame = self.frames[-1]
+        if token_type in type_specifiers:
+            frame[0] = True
+        elif token_type == '(':
+            if self.previous in ('ID', ')', ']'):
+                # parameters have specifiers of their own
+                self.frames.append([False, True, False])
+            else:
+                self.frames.append([frame[0], False, frame[2]])
+        elif token_type == '[':
+            self.frames.append([False, False, True])
+        elif token_type == '{':
+            self.frames.append([False, False, frame[2]])
+        elif token_type in (')', ']', '}'):
+            if len(self.frames) > 1:
+                self.frames.pop()
+        elif token_type == ';':
+            frame[0] = frame[2] = False
+        elif token_type == ',':
+            if frame[1]:
+                frame[0] = False
+            frame[2] = False
+        elif token_type in ('=', ':'):
+            frame[2] = True
+        self.previous = token_type
+
 
 def _(*args): ...
 
@@ -33,7 +94,7 @@ class CalcLexer(Lexer):
         ELLIPSIS, RIGHT_ASSIGN, LEFT_ASSIGN, ADD_ASSIGN, SUB_ASSIGN,
         MUL_ASSIGN, DIV_ASSIGN, MOD_ASSIGN, AND_ASSIGN, XOR_ASSIGN,
         OR_ASSIGN, RIGHT_OP, LEFT_OP, INC_OP, DEC_OP, PTR_OP, AND_OP,
-        OR_OP, LE_OP, GE_OP, EQ_OP, NE_OP
+        OR_OP, LE_OP, GE_OP, EQ_OP, NE_OP, TYPEDEF_NAME
     }
 
     literals = {
@@ -48,66 +109,63 @@ class CalcLexer(Lexer):
     # Ignored characters between tokens
     ignore = ' \t\v\f'
 
+    # file being tokenized, for diagnostics
+    path = None
+
     ignore_comment = r'//.*'
-    ignore_multiline_comment = r'/\*[\S\s]*\*/'
 
     # Regular expression rules for tokens
 
-    AUTO = r'auto'
-    BREAK = r'break'
-    CASE = r'case'
-    CHAR = r'char'
-    CONST = r'const'
-    CONTINUE = r'continue'
-    DEFAULT = r'default'
-    DO = r'do'
-    DOUBLE = r'double'
-    ELSE = r'else'
-    ENUM = r'enum'
-    EXTERN = r'extern'
-    FLOAT = r'float'
-    FOR = r'for'
-    GOTO = r'goto'
-    IF = r'if'
-    INLINE = r'inline'
-    INT = r'int'
-    LONG = r'long'
-    REGISTER = r'register'
-    RESTRICT = r'restrict'
-    RETURN = r'return'
-    SHORT = r'short'
-    SIGNED = r'signed'
-    SIZEOF = r'sizeof'
-    STATIC = r'static'
-    STRUCT = r'struct'
-    SWITCH = r'switch'
-    TYPEDEF = r'typedef'
-    UNION = r'union'
-    UNSIGNED = r'unsigned'
-    VOID = r'void'
-    VOLATILE = r'volatile'
-    WHILE = r'while'
-    ALIGNAS = r'_Alignas'
-    ALIGNOF = r'_Alignof'
-    ATOMIC = r'_Atomic'
-    BOOL = r'_Bool'
-    COMPLEX = r'_Complex'
-    GENERIC = r'_Generic'
-    IMAGINARY = r'_Imaginary'
-    NORETURN = r'_Noreturn'
-    STATIC_ASSERT = r'_Static_assert'
-    THREAD_LOCAL = r'_Thread_local'
-    FUNC_NAME = r'__func__'
-
+    # Keywords are remapped identifiers, so that names like "int8_t" or
+    # "double_value" are not split into a keyword and a remainder
     ID = fr'{alpha}{alpha_num}*'
+    ID['auto'] = AUTO
+    ID['break'] = BREAK
+    ID['case'] = CASE
+    ID['char'] = CHAR
+    ID['const'] = CONST
+    ID['continue'] = CONTINUE
+    ID['default'] = DEFAULT
+    ID['do'] = DO
+    ID['double'] = DOUBLE
+    ID['else'] = ELSE
+    ID['enum'] = ENUM
+    ID['extern'] = EXTERN
+    ID['float'] = FLOAT
+    ID['for'] = FOR
+    ID['goto'] = GOTO
+    ID['if'] = IF
+    ID['inline'] = INLINE
+    ID['int'] = INT
+    ID['long'] = LONG
+    ID['register'] = REGISTER
+    ID['restrict'] = RESTRICT
+    ID['return'] = RETURN
+    ID['short'] = SHORT
+    ID['signed'] = SIGNED
+    ID['sizeof'] = SIZEOF
+    ID['static'] = STATIC
+    ID['struct'] = STRUCT
+    ID['switch'] = SWITCH
+    ID['typedef'] = TYPEDEF
+    ID['union'] = UNION
+    ID['unsigned'] = UNSIGNED
+    ID['void'] = VOID
+    ID['volatile'] = VOLATILE
+    ID['while'] = WHILE
+    ID['_Alignas'] = ALIGNAS
+    ID['_Alignof'] = ALIGNOF
+    ID['_Atomic'] = ATOMIC
+    ID['_Bool'] = BOOL
+    ID['_Complex'] = COMPLEX
+    ID['_Generic'] = GENERIC
+    ID['_Imaginary'] = IMAGINARY
+    ID['_Noreturn'] = NORETURN
+    ID['_Static_assert'] = STATIC_ASSERT
+    ID['_Thread_local'] = THREAD_LOCAL
+    ID['__func__'] = FUNC_NAME
 
-    @_(fr'{hex_prefix}{hex}+{int_suffix}?',
-       fr'{non_zero}{dec}*{int_suffix}?',
-       fr'0{oct}*{int_suffix}?',
-       fr'{char_prefix}?\'([^\'\\\n]|{escaped})+\'')
-    def I_CONSTANT(self, t):
-        return t
-
+    # Floats first, "1.5" is not the constant 1 followed by ".5"
     @_(fr'{dec}+{exponent}{float_suffix}?',
        fr'{dec}*\.{dec}+{exponent}?{float_suffix}?',
        fr'{dec}+\.{exponent}?{float_suffix}?',
@@ -117,8 +175,17 @@ class CalcLexer(Lexer):
     def F_CONSTANT(self, t):
         return t
 
+    @_(fr'{hex_prefix}{hex}+{int_suffix}?',
+       fr'{non_zero}{dec}*{int_suffix}?',
+       fr'0{oct}*{int_suffix}?',
+       fr'{char_prefix}?\'([^\'\\\n]|{escaped})+\'')
+    def I_CONSTANT(self, t):
+        return t
+
     @_(fr'({string_prefix}?"([^"\\\n]|{escaped})*"{whitespace}*)+')
     def STRING_LITERAL(self, t):
+        # adjacent literals are one token, they may be on several lines
+        self.lineno += t.value.count('\n')
         return t
 
     ELLIPSIS = r'\.\.\.'
@@ -130,7 +197,7 @@ class CalcLexer(Lexer):
     DIV_ASSIGN = r'/='
     MOD_ASSIGN = r'%='
     AND_ASSIGN = r'&='
-    XOR_ASSIGN = r'^='
+    XOR_ASSIGN = r'\^='
     OR_ASSIGN = r'\|='
     RIGHT_OP = r'>>'
     LEFT_OP = r'<<'
@@ -164,14 +231,29 @@ class CalcLexer(Lexer):
         t.type = ']'
         return t
 
+    def tokenize(self, text, lineno=1, index=0):
+        # sly only updates lineno in token functions (see ignore_newline)
+        self.lineno = lineno
+        context = DeclarationContext()
+        for token in super().tokenize(text, lineno, index):
+            if token.type == 'ID':
+                token.type = context.name_type(token.value)
+            context.advance(token.type)
+            yield token
+
     # Define a rule so we can track line numbers
 
     @_(r'\n+')
     def ignore_newline(self, t):
         self.lineno += len(t.value)
 
+    # non-greedy, a comment ends at the first "*/"
+    @_(r'/\*[\S\s]*?\*/')
+    def ignore_multiline_comment(self, t):
+        self.lineno += t.value.count('\n')
+
     def error(self, t):
-        print('Line %d: Bad character %r' % (self.lineno, t.value[0]))
+        diagnostics.report('error', f'Bad character {t.value[0]!r}', self.path, self.lineno)
         self.index += 1
 
 
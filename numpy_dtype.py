@@ -0,0 +1,107 @@
+import numpy as np
+
+from codec import is_char
+from layout import is_bit_field, is_pointer, is_struct, is_union, layout_of, named_members
+
+# Exports simplified structs as NumPy structured dtypes with explicit
+# offsets and itemsize, so captures can be decoded with np.frombuffer or
+# np.memmap. NumPy has no bit-fields: each run of bytes holding
+# bit-fields becomes one unsigned field named after all of them, joined
+# with ",". Union members overlap, members of anonymous structs and unions
+# are fields of the enclosing type.
+
+
+def to_dtype(type_desc, byte_order='<'):
+    layout = layout_of(type_desc)
+    members = list(named_members(type_desc))
+
+    # bit-fields are grouped into runs of the bytes holding them, like in
+    # codec: a storage unit may also hold plain members placed between its
+    # bit-fields (SysV), which must not be overlapped
+    runs = {}
+    run = None
+    bit_fields = [(layout['offsets'][name], name, field_desc)
+                  for name, field_desc in members if is_bit_field(field_desc)]
+    for offset, name, field_desc in sorted(bit_fields, key=lambda item: item[0]):
+        start = offset // 8
+        end = -(-(offset + field_desc['size']) // 8)
+        if run is None or start > run['end']:
+            run = {'names': [], 'start': start, 'end': end}
+        run['end'] = max(run['end'], end)
+        run['names'].append(name)
+        runs[name] = run
+
+    names = []
+    formats = []
+    offsets = []
+    for name, field_desc in members:
+        if name in runs:
+            run = runs[name]
+            if run['names'][0] != name:
+                continue
+            names.append(','.join(run['names']))
+            formats.append(unit_dtype(run['end'] - run['start'], byte_order))
+            offsets.append(run['start'])
+            continue
+
+        names.append(name)
+        formats.append(field_dtype(field_desc, name, byte_order))
+        offsets.append(layout['offsets'][name] // 8)
+
+    return np.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': layout['size'] // 8
+    })
+
+
+def field_dtype(field_desc, name, byte_order):
+    if is_struct(field_desc) or is_union(field_desc):
+        return to_dtype(field_desc, byte_order)
+
+    if field_desc['type'] != 'array':
+        return scalar_dtype(field_desc, name, byte_order)
+
+    element = field_desc['element_def']
+    dimensions = field_desc['dimensions']
+    if None in dimensions:
+        raise ValueError(f'Element count of "{name}" is unknown')
+
+    if is_char(element):
+        # the innermost dimension of a character array is a byte string
+        if len(dimensions) == 1:
+            return f'S{dimensions[0]}'
+        return (f'S{dimensions[-1]}', tuple(dimensions[:-1]))
+
+    return (field_dtype(element, name, byte_order), tuple(dimensions))
+
+
+def scalar_dtype(type_desc, name, byte_order):
+    size = type_desc['size']
+    if type(size) is not int:
+        raise ValueError(f'Size of "{name}" is unknown')
+    byte_count = size // 8
+
+    if is_pointer(type_desc):
+        return f'{byte_order}u{byte_count}'
+
+    words = type_desc['type'].split()
+    if type_desc['type'].startswith('complex'):
+        return f'{byte_order}c{byte_count}'
+    if 'float' in words or 'double' in words:
+        if byte_count > 8:
+            # long double has no portable NumPy type, keep the raw bytes
+            return f'V{byte_count}'
+        return f'{byte_order}f{byte_count}'
+    if '_Bool' in words:
+        return '?'
+    if 'unsigned' in words:
+        return f'{byte_order}u{byte_count}'
+    return f'{byte_order}i{byte_count}'
+
+
+def unit_dtype(byte_count, byte_order):
+    if byte_count in (1, 2, 4, 8):
+        return f'{byte_order}u{byte_count}'
+    return f'V{byte_count}'
@@ -0,0 +1,94 @@
+import hashlib
+import json
+from collections import Counter
+from pathlib import Path
+
+# Canonical output. Types are ordered by name, the members of a type keep
+# their declaration order (it defines the layout) and the text does not
+# depend on the order the types were parsed in, so the same types always
+# give the same bytes.
+#
+# A fragment store keeps one file per distinct type description, named
+# after the hash of its text, and an index naming the fragment of every
+# type. Only new fragments are written, a type that did not change keeps
+# its file byte for byte.
+
+
+def fragment_text(type_desc):
+    return json.dumps(type_desc, indent=2)
+
+
+def digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def dumps(types):
+    """Canonical text of a name -> description dictionary."""
+    return json.dumps({name: types[name] for name in sorted(types)}, indent=2)
+
+
+def dump(types, path):
+    text = dumps(types)
+    path = Path(path)
+    if not path.exists() or path.read_text() != text:
+        path.write_text(text)
+
+
+class FragmentStore:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / 'index.json'
+        # type name -> digest of its fragment
+        self.index = {}
+        self.signatures = []
+        if self.index_path.exists():
+            index = json.loads(self.index_path.read_text())
+            self.index = index['types']
+            self.signatures = index['signatures']
+        self.uses = Counter(self.index.values())
+
+    def update(self, types, names=None, signatures=None):
+        """Store the fragments of the named types (every type by default),
+        types missing from `types` are removed. Returns the names whose
+        fragment changed."""
+        names = set(types) | set(self.index) if names is None else set(names)
+        changed = []
+        unused = set()
+        for name in sorted(names):
+            old = self.index.get(name)
+            new = None
+            if name in types:
+                text = fragment_text(types[name])
+                new = digest(text)
+                path = self.directory / f'{new}.json'
+                if not path.exists():
+                    path.write_text(text)
+            if new == old:
+                continue
+
+            changed.append(name)
+            if new is None:
+                del self.index[name]
+            else:
+                self.index[name] = new
+                self.uses[new] += 1
+            if old is not None:
+                self.uses[old] -= 1
+                unused.add(old)
+
+        for old in unused:
+            if not self.uses[old]:
+                del self.uses[old]
+                (self.directory / f'{old}.json').unlink(missing_ok=True)
+
+        new_signatures = signatures is not None and list(signatures) != self.signatures
+        if new_signatures:
+            self.signatures = list(signatures)
+        if not changed and not new_signatures:
+            return changed
+        self.index_path.write_text(json.dumps({
+            'types': {name: self.index[name] for name in sorted(self.index)},
+            'signatures': self.signatures
+        }, indent=2))
+        return changed
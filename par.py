@@ -1,120 +1,1102 @@
 from collections import Counter
 from dataclasses import fields
-from msilib.schema import Error
-from lex import CalcLexer
+import ast as python_ast
+import operator
+import re
+import layout
+from layout import add_bit_field_masks, is_bit_field, is_struct, is_union, layout_cache, type_layout
+from lex import CalcLexer, typedef_names
 from sly import Parser
+from sly.yacc import YaccSymbol
 from pathlib import Path
 import json
 
-# Doesn't handle predefined typedefs and enums
+import diagnostics
+import output
 
-counters = {
-    'struct': 0,
-    'field': 0,
-}
+# Predefined typedefs come only from the prelude (see load_prelude)
+
+# (prefix, line) -> anonymous types named so far in the source being
+# parsed (see anonymous_name)
+anonymous_counts = {}
 
 registered = {
     'struct': {},
     'union': {},
     'enum': {},
+    'typedef': {},
 }
 
 simplified_types = {}
 
+typedefs = {}
+
+enum_constants = {}
+
+# enum constant -> name of its enum
+enum_owners = {}
+
+# struct, enum or typedef name -> names of the types (and enums of the
+# constants) its description was built from
+dependencies = {}
+
+# the reverse of dependencies: name -> names of the types built from it
+dependents = {}
+
+# struct, enum or typedef name -> file it was defined in
+origins = {}
+
+current_file = None
+
+# In lazy mode top-level structs and typedefs are only registered while
+# parsing, they are simplified when something requires them
+lazy = False
+
+# name -> kind ('struct', 'union' or 'typedef') of the registered but not yet
+# simplified types
+deferred = {}
+
+# dependencies of the types being simplified, innermost last
+collecting = []
+
+# function pointer signatures, fields refer to them by their index
+signatures = []
+
+# (returns, parameters, variadic) -> index in signatures
+signature_ids = {}
+
+# lexer of the source being parsed, its line is the location of problems
+current_lexer = None
+
+# lexer parse_source tokenizes with, lex.CalcLexer or the faster
+# scanner.Scanner (same tokens)
+lexer_class = CalcLexer
+
+# In merging mode (see map_files) a struct, union or typedef defined again
+# in another file keeps its first definition, a different one is reported
+merging = False
+
+# name -> line of the definition in its origin file
+lines = {}
+
+# name -> hash of the description, computed when a duplicate is compared
+fingerprints = {}
+
+
+def report(severity, message, line=None, located=False):
+    if line is None and current_lexer is not None:
+        line = current_lexer.lineno
+    diagnostics.report(severity, message, current_file, line, located=located)
+
+
+def depend_on(name):
+    if collecting and name is not None:
+        collecting[-1].add(name)
+
+
+def set_dependencies(name, found, line=None):
+    for dependency in dependencies.get(name, ()):
+        dependents[dependency].discard(name)
+    dependencies[name] = found
+    for dependency in found:
+        dependents.setdefault(dependency, set()).add(name)
+    if current_lexer is not None:
+        # types rebuilt later (resimplify, lazy mode, workers) keep the
+        # file they were parsed from
+        origins[name] = current_file
+    if line is not None:
+        lines[name] = line
+
+
+def redefined(name, type_desc, table, line=None):
+    """Whether `name` was already defined by another file (merging mode
+    only), the new definition starting at `line`. Identical definitions
+    collapse into the first one."""
+    if not merging or name not in table or origins.get(name, current_file) == current_file:
+        return False
+    if fingerprint(name, table[name]) != output.digest(output.fragment_text(type_desc)):
+        report('error', f'Conflicting definitions of "{name}", '
+                        f'first defined in {origins.get(name)}:{lines.get(name)}', line, located=True)
+    return True
+
+
+def overrides_prelude(name, type_desc):
+    # the definition of the source is used, a different one is reported
+    if name not in prelude_typedefs or typedefs.get(name) is not prelude_typedefs[name]:
+        return
+    predefined = prelude_typedefs[name]
+    if output.fragment_text(type_desc) != output.fragment_text(predefined):
+        report('warning', f'Typedef "{name}" overrides the prelude definition '
+                          f'"{predefined["type"]}" ({predefined["size"]} bits)')
+
+
+def fingerprint(name, type_desc):
+    if name not in fingerprints:
+        fingerprints[name] = output.digest(output.fragment_text(type_desc))
+    return fingerprints[name]
+
+
+def affected_by(names):
+    """Every type built from one of the names, directly or through other
+    types, ordered so that a type comes after the types it is built from.
+    Only the affected part of the graph is visited."""
+    affected = set()
+    stack = list(names)
+    while stack:
+        for user in dependents.get(stack.pop(), ()):
+            if user not in affected:
+                affected.add(user)
+                stack.append(user)
+
+    ordered = []
+    visited = set()
+
+    def visit(name):
+        visited.add(name)
+        for dependency in dependencies.get(name, ()):
+            if dependency in affected and dependency not in visited:
+                visit(dependency)
+        ordered.append(name)
+
+    for name in sorted(affected):
+        if name not in visited:
+            visit(name)
+    return ordered
+
+
+def closure(roots):
+    """The roots and every type they are built from."""
+    found = set()
+    stack = list(roots)
+    while stack:
+        name = stack.pop()
+        if name not in found:
+            found.add(name)
+            stack.extend(dependencies.get(name, ()))
+    return found
+
+
+def reachable_types(roots):
+    """The simplified types needed by the roots, in definition order."""
+    needed = closure(roots)
+    return {name: type_desc for name, type_desc in simplified_types.items() if name in needed}
+
+
+def dependency_graph(roots=None):
+    """Adjacency list of the types (limited to what the roots need)."""
+    names = closure(roots) if roots is not None else dependencies
+    graph = {}
+    for name in sorted(names):
+        kind = next((kind for kind in registered if name in registered[kind]), None)
+        graph[name] = {
+            'kind': kind,
+            'file': origins.get(name),
+            'depends_on': sorted(dependencies.get(name, ())),
+        }
+    return graph
+
+
+def add_to_simplified(name, compound):
+    collecting.append(set())
+    try:
+        type_desc = simplify_compound(compound)
+    finally:
+        found = collecting.pop()
+    if redefined(name, type_desc, simplified_types, compound.get('line')):
+        return
+    simplified_types[name] = type_desc
+    fingerprints.pop(name, None)
+    set_dependencies(name, found, compound.get('line'))
+
+
+def add_typedef(name, type_desc):
+    typedefs[name] = type_desc
+    typedef_names.add(name)
+
+
+def add_typedefs(specifiers, init_declarators, base_name=None, line=None):
+    collecting.append(set())
+    try:
+        if base_name is not None:
+            # the struct was defined by the same declaration
+            depend_on(base_name)
+            require(base_name)
+            base_type = simplified_types[base_name]
+        elif pointee_reference(specifiers) is None:
+            base_type = resolve_specifiers(specifiers)
+        else:
+            # only resolved by simplify_declarator when it is not pointed to
+            base_type = None
+            reference = pointee_reference(specifiers)
+            if reference['kind'] != 'typedef' and reference['ref'] not in simplified_types \
+                    and reference['ref'] not in deferred:
+                # typedef of a struct defined later, resolved where it is used
+                base_type = reference
+        added = []
+        for init_declarator in init_declarators:
+            name, type_desc = simplify_declarator(base_type, init_declarator[1], specifiers)
+            if redefined(name, type_desc, typedefs, line):
+                continue
+            overrides_prelude(name, type_desc)
+            add_typedef(name, type_desc)
+            fingerprints.pop(name, None)
+            registered['typedef'][name] = {
+                'specifiers': specifiers,
+                'declarator': init_declarator[1],
+                'line': line
+            }
+            added.append(name)
+    finally:
+        found = collecting.pop()
+    for name in added:
+        if name == base_name:
+            # the struct of the same name is rebuilt with the typedef (see
+            # resimplify), the typedef depends on what the struct uses
+            set_dependencies(name, (found | dependencies.get(name, set())) - {name}, line)
+        else:
+            set_dependencies(name, set(found), line)
+
+
+def defer_typedefs(specifiers, init_declarators, line=None):
+    for init_declarator in init_declarators:
+        name = declarator_name(init_declarator[1])
+        typedef_names.add(name)
+        origins[name] = current_file
+        registered['typedef'][name] = {
+            'specifiers': specifiers,
+            'declarator': init_declarator[1],
+            'line': line
+        }
+        deferred[name] = 'typedef'
+
+
+def require(name):
+    """Simplify a struct or typedef that lazy mode has deferred."""
+    kind = deferred.pop(name, None)
+    if kind is not None:
+        skipping_failures(registered[kind][name].get('line'), resimplify, name)
+
+
+def skipping_failures(line, simplify, *arguments):
+    # a declaration that cannot be simplified is skipped and reported like
+    # a syntax error, the rest of the source is still mapped
+    try:
+        simplify(*arguments)
+    except Exception as error:
+        report('error', f'Declaration skipped, {type(error).__name__}: {error}', line, located=True)
+
+
+def defined_struct(specifiers):
+    # name of the struct or union defined (with its fields) by a declaration
+    if (type(specifiers[0]) is dict and specifiers[0]['meta'] == 'compound_type' and specifiers[0]['type']['meta'] != 'enum'):
+        type_ = specifiers[0]['type']
+        if type_['fields'] is not None:
+            return type_['name']['name']
+    return None
+
+
+def declarator_name(decl):
+    while decl['meta'] != 'identifier':
+        decl = decl['direct'] if decl['meta'] == 'declarator' else decl['name']
+    return decl['name']
+
+
+def add_enum(name, enumerators, line=None):
+    # Every enumerator is evaluated exactly once, later references
+    # (in other enumerators, array sizes, ...) read enum_constants
+    collecting.append(set())
+    values = {}
+    value = -1
+    try:
+        for enumerator in enumerators:
+            if enumerator['value'] is not None:
+                value = evaluate(enumerator['value'])
+            elif value is not None:
+                value += 1
+            enum_constants[enumerator['name']['name']] = value
+            enum_owners[enumerator['name']['name']] = name
+            values[enumerator['name']['name']] = value
+    finally:
+        # enumerators may refer to earlier enumerators of the same enum
+        found = collecting.pop() - {name}
+
+    type_desc = {
+        'type': f'enum {name}',
+        'size': lookup_type_size('enum'),
+        'values': values,
+    }
+    if redefined(name, type_desc, simplified_types, line):
+        # the constants keep the values of the first definition
+        for constant, value in simplified_types[name]['values'].items():
+            enum_constants[constant] = value
+            enum_owners[constant] = name
+        return
+    simplified_types[name] = type_desc
+    fingerprints.pop(name, None)
+    set_dependencies(name, found, line)
+
+
+def resimplify(name):
+    """Rebuild the description of a registered struct, enum or typedef from
+    its syntax tree, after types it depends on have changed."""
+    layout.forget(simplified_types.get(name))
+    layout.forget(typedefs.get(name))
+    if name in registered['typedef']:
+        typedef = registered['typedef'][name]
+        forget_folded(typedef)
+        if defined_struct(typedef['specifiers']) == name:
+            # typedef struct point {...} point; the struct is rebuilt too
+            add_to_simplified(name, typedef['specifiers'][0]['type'])
+        add_typedefs(typedef['specifiers'], [('init_declarator', typedef['declarator'], None)],
+                     defined_struct(typedef['specifiers']), typedef.get('line'))
+    elif name in registered['enum']:
+        forget_folded(registered['enum'][name])
+        add_enum(name, registered['enum'][name]['fields'], registered['enum'][name].get('line'))
+    else:
+        for kind in ('struct', 'union'):
+            if name in registered[kind]:
+                forget_folded(registered[kind][name])
+                add_to_simplified(name, registered[kind][name])
+
+
+def forget_folded(node):
+    # folded constants may refer to enum constants that have changed
+    if type(node) is dict:
+        node.pop('folded', None)
+        node.pop('folded_type', None)
+        nodes = node.values()
+    elif type(node) in (list, tuple):
+        nodes = node
+    else:
+        return
+    for child in nodes:
+        forget_folded(child)
+
+
+def remove_types(names):
+    """Forget the given structs, enums and typedefs (and enum constants)."""
+    for name in names:
+        layout.forget(simplified_types.pop(name, None))
+        layout.forget(typedefs.pop(name, None))
+        typedef_names.discard(name)
+        set_dependencies(name, set())
+        del dependencies[name]
+        origins.pop(name, None)
+        lines.pop(name, None)
+        fingerprints.pop(name, None)
+        deferred.pop(name, None)
+        for kind in registered.values():
+            kind.pop(name, None)
+        if name in prelude_typedefs:
+            # the source had replaced a prelude typedef
+            add_typedef(name, prelude_typedefs[name])
+    for constant, owner in list(enum_owners.items()):
+        if owner in names:
+            del enum_owners[constant]
+            enum_constants.pop(constant, None)
+
+
+def c_div(left, right):
+    # C division truncates toward zero
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+def c_mod(left, right):
+    return left - right * c_div(left, right)
+
+
+binary_operators = {
+    '*': operator.mul,
+    '/': c_div,
+    '%': c_mod,
+    '+': operator.add,
+    '-': operator.sub,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '<': lambda left, right: int(left < right),
+    '>': lambda left, right: int(left > right),
+    '<=': lambda left, right: int(left <= right),
+    '>=': lambda left, right: int(left >= right),
+    '==': lambda left, right: int(left == right),
+    '!=': lambda left, right: int(left != right),
+    '&': operator.and_,
+    '^': operator.xor,
+    '|': operator.or_,
+}
+
+comparison_operators = {'<', '>', '<=', '>=', '==', '!='}
+
+unary_operators = {
+    '+': operator.pos,
+    '-': operator.neg,
+    '~': operator.invert,
+    '!': lambda value: int(not value),
+}
+
+
+def evaluate(expr):
+    """Fold a constant expression to a number, None if it is not constant.
+    The result is kept on the node, so shared subexpressions are folded once."""
+    if type(expr) is not dict:
+        report('warning', f'Expression "{expr}" is not a constant expression')
+        return None
+    if 'folded' not in expr:
+        expr['folded'], expr['folded_type'] = fold(expr)
+    return expr['folded']
+
+
+def evaluated_type(expr):
+    # (bits, unsigned) of an integer constant expression, None for floats
+    evaluate(expr)
+    return expr.get('folded_type') if type(expr) is dict else None
+
+
+def int_type():
+    return lookup_type_size('int'), False
+
+
+def size_type():
+    size_t = typedefs.get('size_t')
+    if size_t is None:
+        return lookup_type_size('pointer'), True
+    return size_t['size'], 'unsigned' in size_t['type'].split()
+
+
+def wrap(value, value_type):
+    """Value converted to an integer type, like C does on overflow."""
+    if value is None or value_type is None or type(value) is float:
+        return value
+    bits, unsigned = value_type
+    value &= (1 << bits) - 1
+    if not unsigned and value >= 1 << (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def promoted(value_type):
+    # integer promotion: types smaller than int become int
+    if value_type is None or value_type[0] < lookup_type_size('int'):
+        return int_type() if value_type is not None else None
+    return value_type
+
+
+def common_type(left, right):
+    # usual arithmetic conversions of two promoted integer types
+    if left is None or right is None:
+        return None
+    left, right = promoted(left), promoted(right)
+    if left[1] == right[1]:
+        return max(left, right)
+    unsigned, signed = (left, right) if left[1] else (right, left)
+    return signed if signed[0] > unsigned[0] else (max(unsigned[0], signed[0]), True)
+
+
+def fold(expr):
+    """(value, type) of a constant expression, see evaluate."""
+    meta = expr['meta']
+    if meta == 'const':
+        value = parse_constant(expr['value'])
+        return value, constant_type(expr['value'], value)
+
+    if meta == 'identifier':
+        depend_on(enum_owners.get(expr['name']))
+        value = enum_constants.get(expr['name'])
+        if value is None:
+            report('warning', f'Constant "{expr["name"]}" is not defined')
+        return value, int_type()
+
+    if meta == 'unary_expression' and expr['op'] in ('sizeof', '_Alignof'):
+        type_desc = type_name_desc(expr['right'])
+        if type_desc is None:
+            return None, None
+        size, align = type_layout(type_desc)
+        value = size if expr['op'] == 'sizeof' else align
+        return (value // 8 if value is not None else None), size_type()
+
+    if meta == 'cast':
+        value = evaluate(expr['expression'])
+        type_desc = type_name_desc(expr['cast_to'])
+        if value is None or type_desc is None or type(type_desc['type']) is not str:
+            return None, None
+        words = type_desc['type'].split()
+        if 'float' in words or 'double' in words:
+            return float(value), None
+        if '_Bool' in words:
+            return int(bool(value)), int_type()
+        value_type = type_desc['size'], 'unsigned' in words or type_desc['type'] == 'pointer'
+        return wrap(int(value), value_type), value_type
+
+    if meta == 'conditional_expression':
+        condition = evaluate(expr['condition'])
+        if condition is None:
+            return None, None
+        chosen = expr['true'] if condition else expr['false']
+        return evaluate(chosen), evaluated_type(chosen)
+
+    if meta == 'unary_expression' and expr['op'] in unary_operators:
+        value = evaluate(expr['right'])
+        if value is None:
+            return None, None
+        if expr['op'] == '!':
+            return unary_operators['!'](value), int_type()
+        value_type = promoted(evaluated_type(expr['right']))
+        return wrap(unary_operators[expr['op']](value), value_type), value_type
+
+    if meta in ('logical_and_expression', 'logical_or_expression'):
+        left = evaluate(expr['left'])
+        if left is None:
+            return None, None
+        if bool(left) == (meta == 'logical_or_expression'):
+            return int(bool(left)), int_type()
+        right = evaluate(expr['right'])
+        return (int(bool(right)) if right is not None else None), int_type()
+
+    if meta.endswith('_expression') and expr.get('op') in binary_operators:
+        left = evaluate(expr['left'])
+        right = evaluate(expr['right'])
+        if left is None or right is None:
+            return None, None
+        if expr['op'] in ('/', '%') and right == 0:
+            report('warning', 'Division by zero in constant expression')
+            return None, None
+        if expr['op'] in ('<<', '>>'):
+            value_type = promoted(evaluated_type(expr['left']))
+        else:
+            value_type = common_type(evaluated_type(expr['left']), evaluated_type(expr['right']))
+            # operands are converted to the common type first
+            left, right = wrap(left, value_type), wrap(right, value_type)
+        value = binary_operators[expr['op']](left, right)
+        if expr['op'] in comparison_operators:
+            return value, int_type()
+        return wrap(value, value_type), value_type
+
+    report('warning', f'Expression "{meta}" is not a constant expression')
+    return None, None
+
+
+def type_name_desc(type_name):
+    # sizeof(expression) needs the types of variables, only type names are supported
+    if type(type_name) is not tuple or type_name[0] != 'type_name':
+        report('warning', 'Only "sizeof(type)" is supported in constant expressions')
+        return None
+
+    type_desc = resolve_specifiers(type_name[1])
+    if type_name[2] is None:
+        return type_desc
+
+    pointer, direct = type_name[2]
+    if direct is not None:
+        report('warning', 'Abstract declarators are not supported in constant expressions')
+        return None
+    return {
+        'type': 'pointer',
+        'size': lookup_type_size('pointer')
+    }
 
-def add_to_simplified(name, ast):
-    simplified_types[name] = simplify_fields(ast)
+
+def parse_constant(value):
+    if value.endswith("'"):
+        return character_constant(value)
+
+    lowered = value.lower()
+    is_hex = lowered.startswith('0x')
+    if '.' in lowered or 'p' in lowered or (not is_hex and 'e' in lowered):
+        digits = lowered.rstrip('fl')
+        return float.fromhex(digits) if is_hex else float(digits)
+
+    digits = lowered.rstrip('ul')
+    if is_hex:
+        return int(digits, 16)
+    if len(digits) > 1 and digits.startswith('0'):
+        return int(digits, 8)
+    return int(digits)
+
+
+escaped_question_mark = re.compile(r'\\[\\?]')
+
+
+def character_constant(value):
+    prefix = value[:value.index("'")]
+    # "\?" is the only C escape Python does not know
+    characters = python_ast.literal_eval(escaped_question_mark.sub(
+        lambda match: '?' if match.group() == '\\?' else match.group(), value[len(prefix):]))
+    if len(characters) > 1:
+        report('warning', f'Multi-character constant {value}, its value is implementation-defined')
+    if prefix:
+        # wide constants keep the last character (like GCC)
+        return ord(characters[-1])
+    # the bytes of a plain constant make up an int, a single one is a char
+    code = 0
+    for character in characters:
+        code = code << 8 | ord(character) & 0xff
+    if len(characters) == 1:
+        return wrap(code, (lookup_type_size('char'), False))
+    return wrap(code, int_type())
+
+
+def constant_type(value, number):
+    """(bits, unsigned) of an integer constant: the first of the types its
+    suffix allows that can represent it, None for floating constants."""
+    if type(number) is float:
+        return None
+    if value.endswith("'"):
+        return int_type()
+    lowered = value.lower()
+    suffix = lowered[len(lowered.rstrip('ul')):]
+    # octal and hexadecimal constants may also be unsigned without a suffix
+    decimal = not lowered.startswith('0')
+    ranks = ('int', 'long', 'long_long')[min(suffix.count('l'), 2):]
+    signedness = (True,) if 'u' in suffix else (False,) if decimal else (False, True)
+    for rank in ranks:
+        bits = lookup_type_size(rank)
+        for unsigned in signedness:
+            if number < 1 << (bits if unsigned else bits - 1):
+                return bits, unsigned
+    return lookup_type_size('long_long'), True
+
+
+prelude = None
+# typedefs of the loaded profile, a source may define them again
+prelude_typedefs = {}
+
+
+def load_prelude(abi):
+    """Register the standard typedefs (stdint.h, stddef.h, ...) of an ABI
+    profile without parsing the system headers that define them, and use
+    the primitive sizes of the profile."""
+    global prelude, prelude_typedefs, size_lookup
+    if prelude is None:
+        with open(Path(__file__).with_name('prelude.json'), 'r') as file:
+            prelude = json.load(file)
+
+    profile = prelude.get(abi)
+    if profile is None:
+        raise ValueError(f'Unknown ABI profile "{abi}". Available: {", ".join(prelude)}')
+
+    if size_lookup is None:
+        load_size_lookup()
+    sizes = profile.get('sizes', {})
+    if any(size_lookup.get(type) != size for type, size in sizes.items()):
+        # a new table, workers may hold the previous one
+        size_lookup = dict(size_lookup, **sizes)
+        layout_cache.clear()
+    rules = profile.get('bit_fields', 'sysv')
+    if rules != layout.bit_field_rules:
+        layout.bit_field_rules = rules
+        layout_cache.clear()
+    prelude_typedefs = profile['typedefs']
+    typedefs.update(profile['typedefs'])
+    typedef_names.update(profile['typedefs'])
+    simplified_types.update(profile.get('types', {}))
+
+
+def simplify_compound(compound):
+    fields = simplify_fields(compound['fields'])
+    type_desc = fields if compound['meta'] == 'struct' else union_desc(fields)
+    if any(is_bit_field(field) for field in fields.values()):
+        add_bit_field_masks(type_desc)
+    return type_desc
+
+
+def union_desc(members):
+    type_desc = {
+        'type': 'union',
+        'size': None,
+        'members': members
+    }
+    type_desc['size'] = type_layout(type_desc)[0]
+    return type_desc
 
 
 def simplify_fields(ast):
     type_desc = {}
+    anonymous_count = 0
+    unnamed_count = 0
     for field in ast:
         if (field['meta'] != 'field'):
             continue
 
-        spec_meta = field['specifiers'][0]['meta']
-        is_compound = spec_meta == 'compound_type'
-        for spec in field['specifiers']:
-            if (spec['meta'] != spec_meta):
-                raise 'Cannot mix primitive and compound type specifiers (i.e. "int" and "struct")'
-
+        specifiers = field['specifiers']
         field_type = None
-        if is_compound:
-            spec_meta = field['specifiers'][0]['type']
-            if (spec_meta['fields'] is None):
-                field_type = fetch_existing(
-                    spec_meta['name']['name'])
-            else:
-                field_type = simplify_fields(spec_meta['fields'])
-
-        else:
-            combined_spec = [spec['type'] for spec in field['specifiers']]
-            field_type = determine_type(combined_spec)
+        if pointee_reference(specifiers) is None:
+            field_type = resolve_specifiers(specifiers)
 
         declarators = field['declarators']
+        if declarators is None:
+            # C11 anonymous struct or union, its members belong to the
+            # enclosing type (see layout.named_members)
+            if field_type is not None and (is_struct(field_type) or is_union(field_type)):
+                type_desc[f'(anonymous {anonymous_count})'] = field_type
+                anonymous_count += 1
+            else:
+                report('warning', f'Field of type "{type_spelling(specifiers)}" has no name, skipped')
+            continue
         if type(declarators) is not list:
             declarators = [declarators]
 
         for decl in declarators:
-            size = None
-            array_size = 0
-            name = ''
-            is_pointer = False
-            pointer_type = ''
-            type_override = None
             if decl['meta'] != 'field_declarator':
                 continue
 
+            if decl['declarator'] is None:
+                # unnamed bit-field, only pads or (": 0") ends a storage unit
+                if field_type is None:
+                    field_type = resolve_specifiers(specifiers)
+                name, desc = f'(unnamed {unnamed_count})', field_type.copy()
+                unnamed_count += 1
+            else:
+                name, desc = simplify_declarator(field_type, decl['declarator'], specifiers)
             if decl['is_bit_field']:
-                size = int(decl['bits'])
+                desc['storage_size'] = desc['size']
+                desc['size'] = evaluate(decl['bits'])
+                desc['bit_field'] = True
+                desc['signed'] = is_signed_bit_field(desc)
+            type_desc[name] = desc
 
-            decl = decl['declarator']
-            if decl['is_pointer']:
-                size = lookup_type_size('pointer')
-                is_pointer = True
-                pointer_type = ' '.join(decl['pointer'])
+    return type_desc
 
-            decl = decl['direct']
 
-            if decl['meta'] == 'function_decl':
-                # has to be a pointer
-                decl = decl['name']
-                size = lookup_type_size('pointer')
-                is_pointer = True
-                pointer_type = ' '.join(decl['pointer'])
-                decl = decl['direct']
-                type_override = f'function_pointer {field_type["type"]}()'
-
-            if decl['meta'] == 'array':
-                array_size = decl['count'][0]['value']
-                name = decl['name']['name']
-
-                type_desc[name] = {
-                    'type': 'array',
-                    'element_count': array_size,
-                    'element_def': field_type
-                }
-            elif decl['meta'] == 'identifier':
-                name = decl['name']
-                type_desc[name] = field_type.copy()
-                if size is not None:
-                    type_desc[name]['size'] = size
-                if is_pointer:
-                    type_desc[name]['is_pointer'] = True
-                    type_desc[name]['pointer'] = pointer_type
-                if type_override is not None:
-                    type_desc[name]['type'] = type_override
+def is_signed_bit_field(type_desc):
+    words = type_desc['type'].split()
+    if words[0] == 'enum' and layout.bit_field_rules == 'sysv':
+        # the underlying type of an enum without negative values is unsigned
+        values = simplified_types.get(words[1], {}).get('values', {})
+        return any(value is not None and value < 0 for value in values.values())
+    # plain int and char bit-fields are signed on every supported ABI
+    return 'unsigned' not in words and '_Bool' not in words
 
+
+primitive_order = {word: position for position, word in enumerate(
+    ('signed', 'unsigned', '_Complex', 'short', 'long', 'char', 'int', '_Bool', 'float', 'double', 'void'))}
+
+
+def resolve_specifiers(specifiers):
+    # Qualifiers and storage classes are plain strings, only type specifiers
+    # are dictionaries
+    specifiers = [spec for spec in specifiers if type(spec) is dict]
+
+    spec_meta = specifiers[0]['meta']
+    for spec in specifiers:
+        if (spec['meta'] != spec_meta):
+            raise 'Cannot mix primitive and compound type specifiers (i.e. "int" and "struct")'
+
+    if spec_meta == 'compound_type':
+        spec_meta = specifiers[0]['type']
+        if spec_meta['meta'] == 'enum':
+            depend_on(spec_meta['name']['name'])
+            return {
+                'type': f"enum {spec_meta['name']['name']}",
+                'size': lookup_type_size('enum')
+            }
+        if (spec_meta['fields'] is None):
+            return fetch_existing(spec_meta['name']['name'])
+        return simplify_compound(spec_meta)
+
+    if spec_meta == 'typedef_name':
+        return fetch_typedef(specifiers[0]['type'])
+
+    # declaration specifiers are collected last first, the spelling of the
+    # type does not depend on the order they were written in
+    combined_spec = sorted((spec['type'] for spec in specifiers), key=primitive_order.get)
+    return determine_type(combined_spec)
+
+
+def simplify_declarator(field_type, decl, specifiers=()):
+    """Name and description of a declarator. The type of the specifiers is
+    resolved here when `field_type` is None."""
+    full = decl
+    pointer = decl['pointer'] if decl['is_pointer'] else None
+    decl = decl['direct']
+
+    if decl['meta'] == 'function_decl':
+        # has to be a pointer, the pointer before it belongs to the return
+        # type, which may be a function pointer itself: int (*(*f)(int))(char)
+        while decl['meta'] == 'function_decl':
+            returns = type_spelling(specifiers, declarator_without(full, decl))
+            signature = intern_signature(returns, decl['arguments'])
+            decl = decl['name']
+            field_type = {
+                'type': 'function_pointer',
+                'size': lookup_type_size('pointer'),
+                'is_pointer': True,
+                'pointer': ' '.join(decl['pointer']),
+                'signature': signature
+            }
+            decl = decl['direct']
+    elif pointer is not None:
+        pointee = pointee_reference(specifiers)
+        if pointee is None:
+            pointee = field_type if field_type is not None else resolve_specifiers(specifiers)
+        field_type = pointer_desc(pointee, pointer)
+    elif field_type is None:
+        field_type = resolve_specifiers(specifiers)
+
+    dimensions = []
+    while decl['meta'] == 'array':
+        dimensions.insert(0, array_count(decl['count']))
+        decl = decl['name']
+    name = decl['name']
+
+    if dimensions:
+        return name, array_desc(field_type, dimensions)
+    return name, field_type if pointer is not None else field_type.copy()
+
+
+def pointer_desc(pointee, pointer):
+    # one description per "*" of the declarator, the last one is the
+    # declared pointer; qualifiers belong to the "*" before them
+    size = lookup_type_size('pointer')
+    type_desc = pointee
+    for token in pointer:
+        if token == '*':
+            type_desc = {
+                'type': 'pointer',
+                'size': size,
+                'is_pointer': True,
+                'pointer': '*',
+                'pointee': type_desc
+            }
+        else:
+            type_desc['pointer'] += f' {token}'
     return type_desc
 
 
+def pointee_reference(specifiers):
+    # Pointers refer to declared types by name instead of containing them,
+    # the type may even be incomplete (struct node *next in struct node)
+    for spec in specifiers:
+        if type(spec) is not dict:
+            continue
+        if spec['meta'] == 'typedef_name':
+            return {'type': spec['type'], 'kind': 'typedef', 'ref': spec['type']}
+        if spec['meta'] == 'compound_type' and spec['type']['fields'] is None:
+            kind = spec['type']['meta']
+            name = spec['type']['name']['name']
+            return {'type': f'{kind} {name}', 'kind': kind, 'ref': name}
+    return None
+
+
+def expand_pointee(type_desc):
+    """Description of the type a pointer points to. Types referred to by
+    name are looked up (and simplified, in lazy mode) only now."""
+    pointee = type_desc['pointee']
+    while pointee is not None and type(pointee.get('ref')) is str:
+        require(pointee['ref'])
+        if pointee['kind'] == 'typedef':
+            pointee = typedefs.get(pointee['ref'])
+        else:
+            pointee = simplified_types.get(pointee['ref'])
+    return pointee
+
+
+def intern_signature(returns, arguments):
+    # "()" declares no prototype, K&R identifier lists name no types either
+    parameters = None
+    variadic = False
+    if arguments is not None and type(arguments[0]) is tuple:
+        parameters = []
+        for argument in arguments:
+            if argument == '...':
+                variadic = True
+            else:
+                parameters.append(type_spelling(argument[0], adjusted_parameter(argument[1])))
+        if parameters == ['void']:
+            parameters = []
+
+    return add_signature(returns, parameters, variadic)
+
+
+def add_signature(returns, parameters, variadic):
+    key = (returns, tuple(parameters) if parameters is not None else None, variadic)
+    index = signature_ids.get(key)
+    if index is None:
+        index = signature_ids[key] = len(signatures)
+        signatures.append({
+            'returns': returns,
+            'parameters': parameters,
+            'variadic': variadic
+        })
+    return index
+
+
+storage_classes = {'typedef', 'extern', 'static', '_Thread_local', 'auto', 'register', 'inline', '_Noreturn'}
+
+
+def type_spelling(specifiers, declarator=None):
+    # C spelling of a type (specifiers and the declarator without its name)
+    words = []
+    for spec in reversed(specifiers):
+        if type(spec) is str:
+            if spec not in storage_classes:
+                words.append(spec)
+        elif type(spec) is dict and spec['meta'] == 'compound_type':
+            words.append(f"{spec['type']['meta']} {spec['type']['name']['name']}")
+        elif type(spec) is dict:
+            words.append(spec['type'])
+    if type(declarator) is not str:
+        declarator = declarator_spelling(declarator)
+    if not declarator:
+        return ' '.join(words)
+    return ' '.join(words) + ('' if declarator.startswith('[') else ' ') + declarator
+
+
+def pointer_spelling(pointer):
+    return ''.join(token if token == '*' else f' {token} ' for token in pointer or ()).strip()
+
+
+def declarator_spelling(decl):
+    # the declarator with its name left out, e.g. "*[4]" or "(*)(int)";
+    # abstract declarators are (pointer, direct) or (kind, inner, suffix)
+    if decl is None or type(decl) is str:
+        return ''
+
+    if type(decl) is tuple and len(decl) == 2:
+        return pointer_spelling(decl[0]) + declarator_spelling(decl[1])
+    if type(decl) is tuple:
+        kind, inner, suffix = decl
+        inner = declarator_spelling(inner)
+        if inner.startswith('*'):
+            inner = f'({inner})'
+        if kind == 'abstract_array':
+            return inner + array_spelling(suffix)
+        return inner + parameters_spelling(suffix)
+
+    meta = decl['meta']
+    if meta == 'declarator':
+        pointer = pointer_spelling(decl['pointer']) if decl['is_pointer'] else ''
+        return pointer + declarator_spelling(decl['direct'])
+    if meta in ('array', 'function_decl'):
+        inner = declarator_spelling(decl['name'])
+        if inner.startswith('*'):
+            inner = f'({inner})'
+        if meta == 'array':
+            return inner + array_spelling(decl['count'])
+        return inner + parameters_spelling(decl['arguments'])
+    return ''
+
+
+def array_spelling(count):
+    if count is None or type(count[-1]) is not dict:
+        return '[]'
+    value = evaluate(count[-1])
+    return f'[{value}]' if value is not None else '[]'
+
+
+def parameters_spelling(arguments):
+    if arguments is None or type(arguments[0]) is not tuple:
+        return '()'
+    return '(' + ', '.join(argument if argument == '...' else type_spelling(argument[0], adjusted_parameter(argument[1]))
+                           for argument in arguments) + ')'
+
+
+def declarator_without(decl, part):
+    # the declarator with `part` left out like its name, i.e. the type
+    # `part` is declared with: the return type of a function declarator
+    if decl is part:
+        return None
+    if decl['meta'] == 'declarator':
+        return {**decl, 'direct': declarator_without(decl['direct'], part)}
+    if decl['meta'] in ('array', 'function_decl'):
+        return {**decl, 'name': declarator_without(decl['name'], part)}
+    return decl
+
+
+def derives(decl):
+    # whether a declarator has pointers, arrays or functions
+    if decl is None or type(decl) is str:
+        return False
+    if type(decl) is tuple:
+        return True
+    if decl['meta'] == 'declarator':
+        return decl['is_pointer'] or derives(decl['direct'])
+    return decl['meta'] in ('array', 'function_decl')
+
+
+def adjusted_parameter(decl):
+    """Declarator of a parameter with an array adjusted to a pointer to its
+    element and a function to a pointer to it, as C does, so that
+    "int a[3]" and "int *a" give the same signature."""
+    if not derives(decl):
+        return decl
+
+    if type(decl) is tuple and len(decl) == 2:
+        pointer, direct = decl
+        # the pointer applies after the suffixes of the direct declarator
+        return (pointer, adjusted_parameter(direct)) if derives(direct) else decl
+    if type(decl) is tuple:
+        kind, inner, suffix = decl
+        if derives(inner):
+            return kind, adjusted_parameter(inner), suffix
+        if kind == 'abstract_array':
+            return ['*'], inner
+        return kind, (['*'], inner), suffix
+
+    if decl['meta'] == 'declarator':
+        return {**decl, 'direct': adjusted_parameter(decl['direct'])} if derives(decl['direct']) else decl
+    if derives(decl['name']):
+        return {**decl, 'name': adjusted_parameter(decl['name'])}
+    if decl['meta'] == 'array':
+        return declarator(['*'], decl['name'])
+    return {**decl, 'name': declarator(['*'], decl['name'])}
+
+
+def array_desc(element_def, dimensions):
+    # Arrays of arrays (e.g. through a typedef) are flattened into one
+    # descriptor, so users never have to walk nested element_def
+    if element_def.get('type') == 'array':
+        dimensions = dimensions + element_def['dimensions']
+        element_def = element_def['element_def']
+
+    element_count = None
+    if None not in dimensions:
+        element_count = 1
+        for count in dimensions:
+            element_count *= count
+
+    stride, _ = type_layout(element_def)
+    size = None
+    if stride is not None and element_count is not None:
+        size = stride * element_count
+
+    return {
+        'type': 'array',
+        'dimensions': dimensions,
+        'element_count': element_count,
+        'stride': stride,
+        'size': size,
+        'element_def': element_def
+    }
+
+
+def array_count(count):
+    if count is None:
+        # flexible array member
+        return 0
+    # the size expression follows "static" and qualifiers, "[*]" has none
+    return evaluate(count[-1]) if type(count[-1]) is dict else None
+
+
 def fetch_existing(name):
+    depend_on(name)
+    require(name)
     t = simplified_types.get(name)
     if t is None:
         return unknown_type(name, f"Type '{name}' is not defined")
     return t
 
 
+def fetch_typedef(name):
+    depend_on(name)
+    require(name)
+    t = typedefs.get(name)
+    if t is None:
+        return unknown_type(name, f"Typedef '{name}' is not defined")
+    if type(t.get('ref')) is str:
+        return fetch_existing(t['ref'])
+    return t
+
+
 def determine_type(arr):
     if 'void' in arr:
         if len(arr) > 1:
@@ -135,8 +1117,8 @@ def determine_type(arr):
     for (key, count) in counts.items():
         if (key == 'long' and count > 2):
             return unknown_type(arr, 'Invalid type. "long" may appear only twice.')
-        elif count > 1:
-            return unknown_type(arr, 'Invalid type. "{key}" may appear only once.')
+        elif key != 'long' and count > 1:
+            return unknown_type(arr, f'Invalid type. "{key}" may appear only once.')
 
     for lst in forbidden:
         if all([key in arr for key in lst]):
@@ -162,6 +1144,11 @@ def determine_type(arr):
     if (not any([is_bool, is_long, is_int, is_float, is_complex])):
         return unknown_type(arr, 'Type is not allowed.')
 
+    if is_bool:
+        if len(arr) > 1:
+            return unknown_type(arr, 'Invalid type. "_Bool" cannot be combined with anything else.')
+        return lookup_type('bool', arr)
+
     result = None
     if is_int:
         if 'char' in arr:
@@ -195,8 +1182,9 @@ def determine_type(arr):
 
 
 def unknown_type(type, msg):
-    print(msg)
-    print(f'Provided: {type}')
+    if isinstance(type, list):
+        msg = f'{msg} (provided: {" ".join(type)})'
+    report('error', msg)
     return {
         'type': f'unknown ({type})',
         'size': 'unknown'
@@ -218,7 +1206,7 @@ def lookup_type_size(type):
         return 0
     size = size_lookup.get(type)
     if size is None:
-        print(f'Size of type "{type}" was not found in the lookup file.')
+        report('warning', f'Size of type "{type}" was not found in the lookup file.')
         return 0
     return size
 
@@ -226,10 +1214,21 @@ def lookup_type_size(type):
 def _(): ...
 
 
-def declaration(specifiers, init_declarators):
-    if (specifiers[0]['meta'] == 'compound_type' and specifiers[0]['type']['meta'] == 'struct'):
-        type = specifiers[0]['type']
-        add_to_simplified(type['name']['name'], type['fields'])
+def declaration(specifiers, init_declarators, line=None):
+    if 'typedef' in specifiers and init_declarators is not None:
+        name_after_typedef(specifiers, init_declarators)
+    base_name = defined_struct(specifiers)
+    if base_name is not None:
+        if lazy:
+            deferred[base_name] = specifiers[0]['type']['meta']
+        else:
+            skipping_failures(line, add_to_simplified, base_name, specifiers[0]['type'])
+
+    if 'typedef' in specifiers and init_declarators is not None:
+        if lazy:
+            defer_typedefs(specifiers, init_declarators, line)
+        else:
+            skipping_failures(line, add_typedefs, specifiers, init_declarators, base_name, line)
 
     return {
         'meta': 'declaration',
@@ -238,6 +1237,38 @@ def declaration(specifiers, init_declarators):
     }
 
 
+def name_after_typedef(specifiers, init_declarators):
+    # an anonymous struct, union or enum defined by a typedef takes the
+    # first name the typedef gives to the type itself (not to a pointer,
+    # array or function of it), unless a tag of that name exists
+    compounds = [specifier['type'] for specifier in specifiers
+                 if type(specifier) is dict and specifier['meta'] == 'compound_type']
+    if not compounds or not compounds[0]['anonymous'] or compounds[0]['fields'] is None:
+        return
+    compound = compounds[0]
+    for init_declarator in init_declarators:
+        declarator = init_declarator[1]
+        if not declarator['is_pointer'] and declarator['direct']['meta'] == 'identifier':
+            name = declarator['direct']['name']
+            break
+    else:
+        return
+    if name in simplified_types or any(name in registered[kind] for kind in ('struct', 'union', 'enum')):
+        return
+
+    kind = compound['meta']
+    anonymous = compound['name']['name']
+    compound['name'] = id(name)
+    compound['anonymous'] = False
+    if registered[kind].get(anonymous) is compound:
+        registered[kind][name] = registered[kind].pop(anonymous)
+        origins[name] = origins.pop(anonymous, current_file)
+    if kind == 'enum' and anonymous in simplified_types:
+        # enums are added as soon as they are parsed (see compound_type)
+        remove_types([anonymous])
+        add_enum(name, compound['fields'], compound['line'])
+
+
 def primitive_type(type):
     return {
         'meta': 'primitive_type',
@@ -245,11 +1276,23 @@ def primitive_type(type):
     }
 
 
+def typedef_name(name):
+    return {
+        'meta': 'typedef_name',
+        'type': name,
+    }
+
+
 def compound_type(type):
     kind = type['meta']
     name = type['name']['name']
     if type['fields'] is not None:
-        registered[kind][name] = type
+        # see redefined, the first definition of a name is kept
+        if not merging or origins.get(name, current_file) == current_file:
+            registered[kind][name] = type
+            origins[name] = current_file
+        if kind == 'enum':
+            skipping_failures(type.get('line'), add_enum, name, type['fields'], type.get('line'))
 
     return {
         'meta': 'compound_type',
@@ -257,21 +1300,50 @@ def compound_type(type):
     }
 
 
-def struct_or_union(type, name, declaration_list):
-    if name == None or name == '':
-        name = id(f"anonymous_{counters['struct']}")
-        counters['struct'] += 1
+def anonymous_name(prefix, line):
+    # named after where they are defined, so that mapping a source again
+    # gives the same names whatever was mapped before it
+    count = anonymous_counts.get((prefix, line), 0)
+    anonymous_counts[(prefix, line)] = count + 1
+    name = f'{prefix}_{line}' if count == 0 else f'{prefix}_{line}_{count + 1}'
+    return id(name if current_file is None else f'{name} ({current_file})')
+
+
+def struct_or_union(type, name, declaration_list, line=None):
+    anonymous = name == None or name == ''
+    if anonymous:
+        name = anonymous_name('anonymous', line)
     return {
         'meta': type,
         'name': name,
-        'fields': declaration_list
+        'fields': declaration_list,
+        'line': line,
+        'anonymous': anonymous
+    }
+
+
+def enum(name, enumerators, line=None):
+    anonymous = name == None or name == ''
+    if anonymous:
+        name = anonymous_name('anonymous_enum', line)
+    return {
+        'meta': 'enum',
+        'name': name,
+        'fields': enumerators,
+        'line': line,
+        'anonymous': anonymous
+    }
+
+
+def enumerator(name, value):
+    return {
+        'meta': 'enumerator',
+        'name': name,
+        'value': value
     }
 
 
 def field(specifiers, declarators):
-    if declarators == None or declarators.count == 0:
-        declarators = id([f"anonymous_{counters['field']}"])
-        counters['field'] += 1
     return {
         'meta': 'field',
         'specifiers': specifiers,
@@ -428,11 +1500,14 @@ class CalcParser(Parser):
 
     @_('constant',
        'string',
-       '"(" expression ")"',
        'generic_selection')
     def primary_expression(self, p):
         return p[0]
 
+    @_('"(" expression ")"')
+    def primary_expression(self, p):
+        return p.expression
+
     @_('I_CONSTANT', 'F_CONSTANT',
        #    'ENUMERATION_CONSTANT'
        )
@@ -658,11 +1733,11 @@ class CalcParser(Parser):
 
     @_('declaration_specifiers ";"')
     def declaration(self, p):
-        return declaration(p[0], None)
+        return declaration(p[0], None, p.lineno)
 
     @_('declaration_specifiers init_declarator_list ";"')
     def declaration(self, p):
-        return declaration(p[0], p[1])
+        return declaration(p[0], p[1], p.lineno)
 
     @_('static_assert_declaration')
     def declaration(self, p):
@@ -706,8 +1781,7 @@ class CalcParser(Parser):
 
     @_('VOID', 'CHAR', 'SHORT', 'INT',
        'LONG', 'FLOAT', 'DOUBLE', 'SIGNED',
-       'UNSIGNED', 'BOOL', 'COMPLEX', 'IMAGINARY'  # 'TYPEDEF_NAME'
-       )
+       'UNSIGNED', 'BOOL', 'COMPLEX', 'IMAGINARY')
     def type_specifier(self, p):
         return primitive_type(p[0])
 
@@ -716,13 +1790,17 @@ class CalcParser(Parser):
     def type_specifier(self, p):
         return compound_type(p[0])
 
+    @_('TYPEDEF_NAME')
+    def type_specifier(self, p):
+        return typedef_name(p[0])
+
     @_('struct_or_union "{" struct_declaration_list "}"')
     def struct_or_union_specifier(self, p):
-        return struct_or_union(p[0], None, p.struct_declaration_list)
+        return struct_or_union(p[0], None, p.struct_declaration_list, p.lineno)
 
     @_('struct_or_union ID "{" struct_declaration_list "}"')
     def struct_or_union_specifier(self, p):
-        return struct_or_union(p[0], id(p.ID), p.struct_declaration_list)
+        return struct_or_union(p[0], id(p.ID), p.struct_declaration_list, p.lineno)
 
     @_('struct_or_union ID')
     def struct_or_union_specifier(self, p):
@@ -790,15 +1868,15 @@ class CalcParser(Parser):
 
     @_('ENUM "{" enumerator_list "}"', 'ENUM "{" enumerator_list "," "}"')
     def enum_specifier(self, p):
-        return (p[0], None, p[2])
+        return enum(None, p[2], p.lineno)
 
     @_('ENUM ID "{" enumerator_list "}"', 'ENUM ID "{" enumerator_list "," "}"')
     def enum_specifier(self, p):
-        return (p[0], p[1], p[3])
+        return enum(id(p.ID), p[3], p.lineno)
 
     @_('ENUM ID')
     def enum_specifier(self, p):
-        return (p[0], p[1], None)
+        return enum(id(p.ID), None)
 
     @_('enumerator')
     def enumerator_list(self, p):
@@ -810,11 +1888,11 @@ class CalcParser(Parser):
 
     @_('enumeration_constant "=" constant_expression')
     def enumerator(self, p):
-        return (p[0], p[2])
+        return enumerator(p[0], p[2])
 
     @_('enumeration_constant')
     def enumerator(self, p):
-        return (p[0], None)
+        return enumerator(p[0], None)
 
     @_('ATOMIC "(" type_name ")"')
     def atomic_type_specifier(self, p):
@@ -922,7 +2000,7 @@ class CalcParser(Parser):
     @_('declaration_specifiers declarator',
        'declaration_specifiers abstract_declarator')
     def parameter_declaration(self, p):
-        return (p[0], None)
+        return (p[0], p[1])
 
     @_('declaration_specifiers')
     def parameter_declaration(self, p):
@@ -1187,11 +2265,154 @@ class CalcParser(Parser):
     def declaration_list(self, p):
         return p[0] + [p[1]]
 
+    def error(self, token):
+        # Panic mode: drop the declaration being parsed, skip to the ";" or
+        # "}" that ends it at top level and continue after it. Declarations
+        # completed before are kept, the stacks are unwound to them.
+        if token is None:
+            report('error', 'Unexpected end of input')
+            return self.resume(self.end_token())
+
+        depth = sum(1 for symbol in self.symstack if symbol.type == '{')
+        report('error', f'Unexpected "{token.value}", declaration skipped', token.lineno, located=True)
+        while token is not None:
+            if token.type == '{':
+                depth += 1
+            elif token.type == '}':
+                depth -= 1
+                if depth <= 0:
+                    token = next(self.tokens, None)
+                    if token is not None and token.type == ';':
+                        token = next(self.tokens, None)
+                    return self.resume(token or self.end_token())
+            elif token.type == ';' and depth <= 0:
+                return self.resume(next(self.tokens, None) or self.end_token())
+            token = next(self.tokens, None)
+        return self.resume(self.end_token())
+
+    def resume(self, token):
+        # keep only the translation unit parsed so far
+        kept = 2 if len(self.symstack) > 1 and self.symstack[1].type == 'translation_unit' else 1
+        if kept == 1 and token.type == '$end':
+            return None
+        del self.symstack[kept:]
+        del self.statestack[kept:]
+        self.state = self.statestack[-1]
+        return token
+
+    @staticmethod
+    def end_token():
+        token = YaccSymbol()
+        token.type = '$end'
+        return token
+
+
+def reset():
+    """Forget every type seen so far (keeps the loaded lookup and prelude files)."""
+    anonymous_counts.clear()
+    for kind in registered.values():
+        kind.clear()
+    simplified_types.clear()
+    typedefs.clear()
+    typedef_names.clear()
+    enum_constants.clear()
+    enum_owners.clear()
+    dependencies.clear()
+    dependents.clear()
+    origins.clear()
+    deferred.clear()
+    lines.clear()
+    fingerprints.clear()
+    diagnostics.clear()
+    signatures.clear()
+    signature_ids.clear()
+    layout_cache.clear()
+
+
+def load_size_lookup():
+    global size_lookup
+    with open(Path(__file__).with_name('lookup.json'), 'r') as file:
+        size_lookup = json.load(file)
+
+
+def map_source(data, abi='lp64', roots=None):
+    """Simplified types of every struct in a C source, starting from a clean
+    registry with the prelude of the ABI profile. When root type names are
+    given only the roots and the types they need are simplified. Returns
+    the types, the function pointer signatures they refer to by index and
+    the problems found (see diagnostics.entries)."""
+    global lazy
+    reset()
+    if size_lookup is None:
+        load_size_lookup()
+    load_prelude(abi)
+
+    if roots is None:
+        parse_source(data)
+        return dict(simplified_types), list(signatures), diagnostics.entries()
+
+    lazy = True
+    try:
+        parse_source(data)
+    finally:
+        lazy = False
+    return rooted_types(roots), list(signatures), diagnostics.entries()
+
+
+def rooted_types(roots):
+    """Simplify the roots parsed in lazy mode and what they need, returns
+    their descriptions."""
+    for root in roots:
+        require(root)
+    types = reachable_types(roots)
+    for root in roots:
+        if root not in types and root in typedefs:
+            types[root] = typedefs[root]
+    return types
+
+
+def map_files(paths, abi='lp64'):
+    """Simplified types of several C sources merged into one registry. A
+    struct, union, enum or typedef defined in more than one file is kept
+    once, definitions that differ from the first one are reported as
+    errors with both locations. Returns the same as map_source."""
+    global merging
+    reset()
+    if size_lookup is None:
+        load_size_lookup()
+    load_prelude(abi)
+
+    merging = True
+    try:
+        for path in paths:
+            parse_source(Path(path).read_text(), path)
+    finally:
+        merging = False
+    return dict(simplified_types), list(signatures), diagnostics.entries()
+
+
+def parse_source(data, path=None, first_line=1):
+    """Parse a C source, adding its types to the current registry. Types
+    are recorded as defined in `path`, the source starts at `first_line`
+    of it."""
+    global current_file, current_lexer
+    current_file = str(path) if path is not None else None
+    anonymous_counts.clear()
+    lexer = current_lexer = lexer_class()
+    lexer.path = current_file
+    parser = CalcParser()
+    try:
+        return parser.parse(lexer.tokenize(data, first_line))
+    finally:
+        current_file = None
+        current_lexer = None
+
 
 if __name__ == '__main__':
     data = Path("examples/simple_multi.c").read_text()
     with open('lookup.json', 'r') as file:
         size_lookup = json.load(file)
+    load_prelude('lp64')
 
     lexer = CalcLexer()
     parser = CalcParser()
@@ -1205,5 +2426,6 @@ if __name__ == '__main__':
         json.dump(result, file, indent=2)
 
     # print(json.dumps(registered, indent=2))
-    with open('result.json', 'w') as file:
-        json.dump(simplified_types, file, indent=2)
+    output.dump(simplified_types, 'result.json')
+
+    diagnostics.render()
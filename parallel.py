@@ -0,0 +1,266 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import diagnostics
+import layout
+import par
+
+# most types sent to a worker at once
+batch_size = 64
+
+# Simplifies the types of a source in a pool of worker processes. The
+# source is parsed in lazy mode, which only registers the syntax trees of
+# structs, unions and typedefs. The names each tree refers to give the
+# dependency graph: a type is sent to a worker as soon as the types it
+# needs are simplified, together with their descriptions. Results are
+# merged in definition order, so the output does not depend on the order
+# the workers finish in.
+
+
+def map_source(data, abi='lp64', max_workers=None):
+    """Like par.map_source, with the types simplified in parallel."""
+    par.reset()
+    if par.size_lookup is None:
+        par.load_size_lookup()
+    par.load_prelude(abi)
+
+    par.lazy = True
+    try:
+        par.parse_source(data)
+    finally:
+        par.lazy = False
+    simplify_deferred(max_workers)
+    return dict(par.simplified_types), list(par.signatures), diagnostics.entries()
+
+
+def simplify_deferred(max_workers=None):
+    """Simplify every type lazy mode has deferred."""
+    order = list(par.deferred)
+    kinds = dict(par.deferred)
+    needs = {name: required_names(name, kinds) for name in order}
+    waiting = {name: set(needs[name]) for name in order}
+    users = {}
+    for name in order:
+        for dependency in waiting[name]:
+            users.setdefault(dependency, []).append(name)
+
+    done = set()
+    ready = [name for name in order if not waiting[name]]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(par.size_lookup, layout.bit_field_rules)) as executor:
+        running = {}
+
+        def submit():
+            # ready types are sent in batches, a task per type costs more
+            # than simplifying a small struct
+            while ready and len(running) < 2 * workers:
+                size = min(batch_size, max(1, len(ready) // workers))
+                batch = ready[:size]
+                del ready[:size]
+                tasks = [task(name, kinds[name], needs[name]) for name in batch]
+                running[executor.submit(simplify_batch, tasks)] = batch
+
+        submit()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch = running.pop(future)
+                for name, result in zip(batch, future.result()):
+                    merge_result(name, kinds[name], result)
+                    done.add(name)
+                    for user in users.get(name, ()):
+                        waiting[user].discard(name)
+                        if not waiting[user]:
+                            ready.append(user)
+            submit()
+
+    # types on a cycle (only possible through invalid sources) are left to
+    # the serial path, which reports them
+    for name in order:
+        if name not in done:
+            par.require(name)
+
+    # definition order, like serial mapping in lazy mode
+    types = [(name, par.simplified_types.pop(name)) for name in order if name in par.simplified_types]
+    par.simplified_types.update(types)
+    number_signatures([par.typedefs.get(name) or par.simplified_types.get(name) for name in order])
+
+
+def required_names(name, kinds):
+    # structs, unions and typedefs that have to be simplified before `name`
+    kind = kinds[name]
+    node = par.registered[kind][name]
+    names = set()
+    constants = set()
+    references(node['fields'] if kind != 'typedef' else node, names, constants)
+    return {found for found in names if found in kinds and found != name}
+
+
+def references(node, names, constants):
+    # names of the types and constants a syntax tree uses; types only
+    # pointed to are not needed (see par.pointee_reference)
+    if type(node) in (list, tuple):
+        for child in node:
+            references(child, names, constants)
+        return
+    if type(node) is not dict:
+        return
+
+    meta = node.get('meta')
+    if meta == 'compound_type':
+        names.add(node['type']['name']['name'])
+        references(node['type']['fields'], names, constants)
+    elif meta == 'typedef_name':
+        names.add(node['type'])
+    elif meta == 'identifier':
+        constants.add(node['name'])
+    elif meta == 'field' and is_pointed_to(node):
+        references(node['declarators'], names, constants)
+    elif meta == 'function_decl':
+        # parameter types are only spelled in the signature
+        references(node['name'], names, constants)
+    else:
+        for child in node.values():
+            references(child, names, constants)
+
+
+def is_pointed_to(field):
+    declarators = field['declarators']
+    if par.pointee_reference(field['specifiers']) is None or declarators is None:
+        return False
+    if type(declarators) is not list:
+        declarators = [declarators]
+    return all(decl['declarator'] is not None and (
+        decl['declarator']['is_pointer'] or decl['declarator']['direct']['meta'] == 'function_decl')
+        for decl in declarators if decl['meta'] == 'field_declarator')
+
+
+def task(name, kind, needs):
+    node = par.registered[kind][name]
+    names = set()
+    constants = set()
+    references(node, names, constants)
+
+    types = {}
+    typedefs = {}
+    for found in names | needs:
+        if found in par.typedefs:
+            typedefs[found] = par.typedefs[found]
+            target = par.typedefs[found].get('ref')
+            if type(target) is str and target in par.simplified_types:
+                types[target] = par.simplified_types[target]
+        if found in par.simplified_types:
+            types[found] = par.simplified_types[found]
+
+    constants = {constant: (par.enum_constants[constant], par.enum_owners.get(constant))
+                 for constant in constants if constant in par.enum_constants}
+    return name, kind, node, types, typedefs, constants, len(par.signatures)
+
+
+def start_worker(size_lookup, bit_field_rules):
+    par.size_lookup = size_lookup
+    layout.bit_field_rules = bit_field_rules
+
+
+def simplify_batch(tasks):
+    return [simplify_remote(*arguments) for arguments in tasks]
+
+
+def simplify_remote(name, kind, node, types, typedefs, constants, base):
+    # runs in a worker: a registry holding only what the type needs
+    par.reset()
+    # signatures found here are numbered after the ones the inputs refer to
+    par.signatures.extend([None] * base)
+    par.simplified_types.update(types)
+    par.typedefs.update(typedefs)
+    for constant, (value, owner) in constants.items():
+        par.enum_constants[constant] = value
+        par.enum_owners[constant] = owner
+    par.registered[kind][name] = node
+    par.resimplify(name)
+
+    type_desc = par.typedefs[name] if kind == 'typedef' else par.simplified_types[name]
+    # "typedef struct point {...} point;" also defines the struct, deferred
+    # under the same name as the typedef
+    compound = None
+    if kind == 'typedef' and par.defined_struct(node['specifiers']) == name:
+        compound = par.simplified_types[name]
+    return type_desc, compound, par.dependencies[name], base, par.signatures[base:], diagnostics.entries()
+
+
+def merge_result(name, kind, result):
+    type_desc, compound, found, base, signatures, entries = result
+    # signatures new to the worker are replaced by the shared ones
+    indices = [par.add_signature(s['returns'], s['parameters'], s['variadic']) for s in signatures]
+    seen = set()
+    renumber_signatures(type_desc, base, indices, seen)
+
+    if kind == 'typedef':
+        par.add_typedef(name, type_desc)
+    else:
+        par.simplified_types[name] = type_desc
+    if compound is not None:
+        renumber_signatures(compound, base, indices, seen)
+        par.simplified_types[name] = compound
+    par.set_dependencies(name, found, par.registered[kind][name].get('line'))
+    par.deferred.pop(name, None)
+    diagnostics.merge(entries)
+
+
+def number_signatures(type_descs):
+    # signatures are numbered in the order the types use them, not in the
+    # order the workers found them
+    renumbered = {}
+    order = []
+
+    def visit(type_desc):
+        if type(type_desc) is not dict or id(type_desc) in seen:
+            return
+        seen.add(id(type_desc))
+        if type_desc.get('type') == 'function_pointer':
+            if type_desc['signature'] not in renumbered:
+                renumbered[type_desc['signature']] = len(order)
+                order.append(type_desc['signature'])
+            return
+        for child in type_desc.values():
+            visit(child)
+
+    seen = set()
+    for type_desc in type_descs:
+        visit(type_desc)
+    for index in range(len(par.signatures)):
+        if index not in renumbered:
+            renumbered[index] = len(order)
+            order.append(index)
+
+    seen = set()
+    for type_desc in list(par.typedefs.values()) + list(par.simplified_types.values()):
+        renumber(type_desc, renumbered, seen)
+    signatures = [par.signatures[index] for index in order]
+    par.signatures.clear()
+    par.signature_ids.clear()
+    for signature in signatures:
+        par.add_signature(signature['returns'], signature['parameters'], signature['variadic'])
+
+
+def renumber(type_desc, renumbered, seen):
+    if type(type_desc) is not dict or id(type_desc) in seen:
+        return
+    seen.add(id(type_desc))
+    if type_desc.get('type') == 'function_pointer':
+        type_desc['signature'] = renumbered[type_desc['signature']]
+        return
+    for child in type_desc.values():
+        renumber(child, renumbered, seen)
+
+
+def renumber_signatures(type_desc, base, indices, seen):
+    if type(type_desc) is not dict or id(type_desc) in seen:
+        return
+    seen.add(id(type_desc))
+    if type_desc.get('type') == 'function_pointer':
+        if type_desc['signature'] >= base:
+            type_desc['signature'] = indices[type_desc['signature'] - base]
+        return
+    for child in type_desc.values():
+        renumber_signatures(child, base, indices, seen)
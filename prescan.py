@@ -0,0 +1,233 @@
+import argparse
+import bisect
+import json
+from pathlib import Path
+
+import diagnostics
+import output
+import par
+from scanner import Scanner
+
+# Index of the top-level definitions of a source, to map one type of a
+# large file without parsing all of it. A pre-scan over the tokens (no
+# parser) finds the byte range of every top-level declaration defining a
+# struct, union, enum or typedef, the names it defines and the names it
+# uses. The index is saved beside the source as "<source>.index.json" and
+# rebuilt when the source changes. A query parses only the ranges of the
+# requested type and of the types it needs, in file order. Sources are
+# scanned and parsed with "\r\n" line ends read as "\n" (like read_text
+# does for par.map_source), the offsets are those of the file.
+
+names = ('ID', 'TYPEDEF_NAME')
+tags = {'STRUCT': 'struct', 'UNION': 'union', 'ENUM': 'enum'}
+
+
+def index_path(path):
+    path = Path(path)
+    return path.with_name(path.name + '.index.json')
+
+
+def top_level_declarations(text):
+    """Tokens of each top-level declaration or function definition."""
+    declaration = []
+    depth = 0
+    function = False
+    for token in Scanner().tokenize(text):
+        declaration.append(token)
+        if token.type == '{':
+            if depth == 0 and len(declaration) > 1 and declaration[-2].type == ')':
+                function = True
+            depth += 1
+        elif token.type == '}':
+            depth = max(depth - 1, 0)
+            if depth == 0 and function:
+                yield declaration
+                declaration = []
+                function = False
+        elif token.type == ';' and depth == 0:
+            yield declaration
+            declaration = []
+    if declaration:
+        yield declaration
+
+
+def defined_names(declaration):
+    """name -> kind ('struct', 'union', 'enum', 'enumerator' or 'typedef')
+    of the names a top-level declaration defines."""
+    defined = {}
+    depth = 0
+    enum_depth = None
+    typedef = any(token.type == 'TYPEDEF' for token in declaration)
+    # typedef names: the last name of each declarator outside of brackets,
+    # braces and parameter lists
+    brackets = 0
+    parentheses = []
+    last = None
+    for position, token in enumerate(declaration):
+        previous = declaration[position - 1].type if position else None
+        following = declaration[position + 1].type if position + 1 < len(declaration) else None
+        if token.type == '{':
+            if depth == 0 and previous in names and position > 1 and declaration[position - 2].type in tags:
+                defined[declaration[position - 1].value] = tags[declaration[position - 2].type]
+            if depth == 0 and (previous == 'ENUM' or previous in names and position > 1
+                               and declaration[position - 2].type == 'ENUM'):
+                # anonymous enums define their constants too
+                enum_depth = 1
+            depth += 1
+        elif token.type == '}':
+            depth -= 1
+            if enum_depth is not None and depth < enum_depth:
+                enum_depth = None
+        elif depth == enum_depth and token.type in names and previous in ('{', ','):
+            defined[token.value] = 'enumerator'
+        elif not typedef or depth > 0:
+            continue
+        elif token.type == '[':
+            brackets += 1
+        elif token.type == ']':
+            brackets -= 1
+        elif token.type == '(':
+            parentheses.append(previous in (')', ']') or previous in names)
+        elif token.type == ')':
+            if parentheses:
+                parentheses.pop()
+        elif token.type == ',' and not brackets and not any(parentheses):
+            if last is not None:
+                defined[last] = 'typedef'
+            last = None
+        elif (token.type in names and not brackets and not any(parentheses)
+              and previous not in tags and following != '{'):
+            last = token.value
+    if typedef and last is not None:
+        defined[last] = 'typedef'
+    return defined
+
+
+def normalized(text):
+    return text.replace('\r\n', '\n')
+
+
+def source_positions(text, positions):
+    """Character positions in the text of positions in normalized(text)."""
+    removed = []
+    index = text.find('\r\n')
+    while index >= 0:
+        # position of the "\n" in the normalized text
+        removed.append(index - len(removed))
+        index = text.find('\r\n', index + 2)
+    if not removed:
+        return {position: position for position in positions}
+    return {position: position + bisect.bisect_left(removed, position) for position in positions}
+
+
+def byte_offsets(text, positions):
+    """Offsets in the UTF-8 encoded text of character positions."""
+    if text.isascii():
+        return {position: position for position in positions}
+    offsets = {}
+    character = offset = 0
+    for position in sorted(set(positions)):
+        offset += len(text[character:position].encode())
+        character = position
+        offsets[position] = offset
+    return offsets
+
+
+def scan(text):
+    """Index entries of the declarations defining types, in file order."""
+    found = []
+    for declaration in top_level_declarations(normalized(text)):
+        defined = defined_names(declaration)
+        if not defined:
+            continue
+        uses = {token.value for token in declaration if token.type in names} - set(defined)
+        found.append({
+            'start': declaration[0].index,
+            'end': declaration[-1].end,
+            'line': declaration[0].lineno,
+            'names': defined,
+            'uses': sorted(uses),
+        })
+    positions = source_positions(text, [entry[key] for entry in found for key in ('start', 'end')])
+    offsets = byte_offsets(text, positions.values())
+    for entry in found:
+        entry['start'] = offsets[positions[entry['start']]]
+        entry['end'] = offsets[positions[entry['end']]]
+    return found
+
+
+def load_index(path):
+    """Index of a source, scanned again if the source changed since the
+    saved index was written."""
+    path = Path(path)
+    stat = path.stat()
+    saved = index_path(path)
+    if saved.exists():
+        index = json.loads(saved.read_text())
+        if index['mtime'] == stat.st_mtime_ns and index['size'] == stat.st_size:
+            return index
+
+    index = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'declarations': scan(path.read_bytes().decode()),
+    }
+    saved.write_text(json.dumps(index, indent=2))
+    return index
+
+
+def needed_declarations(index, roots):
+    """Positions in the index of the declarations defining the roots and
+    the names they use, in file order."""
+    defining = {}
+    for position, entry in enumerate(index['declarations']):
+        for name in entry['names']:
+            defining.setdefault(name, []).append(position)
+
+    needed = set()
+    pending = list(roots)
+    seen = set(pending)
+    while pending:
+        for position in defining.get(pending.pop(), ()):
+            if position in needed:
+                continue
+            needed.add(position)
+            for name in index['declarations'][position]['uses']:
+                if name not in seen:
+                    seen.add(name)
+                    pending.append(name)
+    return sorted(needed)
+
+
+def map_types(path, roots, abi='lp64'):
+    """Like par.map_source with roots for a file, parsing only the
+    declarations the roots need (see load_index)."""
+    index = load_index(path)
+    par.reset()
+    if par.size_lookup is None:
+        par.load_size_lookup()
+    par.load_prelude(abi)
+
+    par.lazy = True
+    try:
+        with open(path, 'rb') as file:
+            for position in needed_declarations(index, roots):
+                entry = index['declarations'][position]
+                file.seek(entry['start'])
+                text = normalized(file.read(entry['end'] - entry['start']).decode())
+                par.parse_source(text, path, entry['line'])
+    finally:
+        par.lazy = False
+    return par.rooted_types(roots), list(par.signatures), diagnostics.entries()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Map some types of a C source using its definition index')
+    arguments.add_argument('path')
+    arguments.add_argument('names', nargs='+')
+    arguments.add_argument('--abi', default='lp64')
+    options = arguments.parse_args()
+
+    types, _, _ = map_types(options.path, options.names, options.abi)
+    print(output.dumps(types))
+    diagnostics.render()
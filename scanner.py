@@ -0,0 +1,350 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from sly.lex import Token
+
+import diagnostics
+from lex import CalcLexer, DeclarationContext
+
+# A hand-written alternative to CalcLexer giving the same tokens (types,
+# values, lines and indexes) without regular expressions or per-token
+# callbacks. The first character of a token selects how it is scanned
+# through a table of character classes, constants, literals and comments
+# are then read by small loops that follow the patterns of lex.py.
+#
+# par.lexer_class chooses the lexer the parser uses, `python scanner.py
+# FILE...` checks that both lexers agree on the files and times them.
+
+BLANK, NEWLINE, NAME, DIGIT, DOT, QUOTE, DOUBLE_QUOTE, SLASH, PUNCTUATION, OTHER = range(10)
+
+classes = [OTHER] * 128
+for char in ' \t\v\f':
+    classes[ord(char)] = BLANK
+classes[ord('\n')] = NEWLINE
+for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_':
+    classes[ord(char)] = NAME
+for char in '0123456789':
+    classes[ord(char)] = DIGIT
+classes[ord('.')] = DOT
+classes[ord("'")] = QUOTE
+classes[ord('"')] = DOUBLE_QUOTE
+classes[ord('/')] = SLASH
+for char in CalcLexer.literals | set('<>%:-+*&|^!='):
+    if classes[ord(char)] == OTHER:
+        classes[ord(char)] = PUNCTUATION
+
+name_chars = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_0123456789')
+octal_digits = frozenset('01234567')
+decimal_digits = frozenset('0123456789')
+hex_digits = frozenset('0123456789abcdefABCDEF')
+string_blanks = frozenset(' \t\v\n\f')
+simple_escapes = frozenset('\'"?\\abfnrtv')
+
+# keyword -> token type, as remapped from ID by CalcLexer
+keywords = CalcLexer._remapping['ID']
+
+# first character -> (text, token type) of the operators starting with it,
+# longest first
+operators = {}
+for text, kind in [
+        ('...', 'ELLIPSIS'), ('>>=', 'RIGHT_ASSIGN'), ('<<=', 'LEFT_ASSIGN'),
+        ('+=', 'ADD_ASSIGN'), ('-=', 'SUB_ASSIGN'), ('*=', 'MUL_ASSIGN'), ('/=', 'DIV_ASSIGN'),
+        ('%=', 'MOD_ASSIGN'), ('&=', 'AND_ASSIGN'), ('^=', 'XOR_ASSIGN'), ('|=', 'OR_ASSIGN'),
+        ('>>', 'RIGHT_OP'), ('<<', 'LEFT_OP'), ('++', 'INC_OP'), ('--', 'DEC_OP'), ('->', 'PTR_OP'),
+        ('&&', 'AND_OP'), ('||', 'OR_OP'), ('<=', 'LE_OP'), ('>=', 'GE_OP'), ('==', 'EQ_OP'),
+        ('!=', 'NE_OP'), ('<%', '{'), ('%>', '}'), ('<:', '['), (':>', ']')]:
+    operators.setdefault(text[0], []).append((text, kind))
+for candidates in operators.values():
+    candidates.sort(key=lambda candidate: -len(candidate[0]))
+
+
+def skip(text, index, chars):
+    length = len(text)
+    while index < length and text[index] in chars:
+        index += 1
+    return index
+
+
+def exponent_end(text, index, marks):
+    # end of an exponent ("e+10", "p-3") at index, -1 if there is none
+    if index >= len(text) or text[index] not in marks:
+        return -1
+    index += 1
+    if index < len(text) and text[index] in '+-':
+        index += 1
+    end = skip(text, index, decimal_digits)
+    return end if end > index else -1
+
+
+def float_end(text, index):
+    """End of the floating constant at index, -1 if there is none."""
+    if text.startswith(('0x', '0X'), index):
+        start = index + 2
+        index = skip(text, start, hex_digits)
+        digits = index > start
+        if index < len(text) and text[index] == '.':
+            after = skip(text, index + 1, hex_digits)
+            if after > index + 1:
+                index, digits = after, True
+            else:
+                index += 1
+        # hexadecimal floats need the exponent
+        index = exponent_end(text, index, 'pP') if digits else -1
+        if index < 0:
+            return -1
+    else:
+        start = index
+        index = skip(text, start, decimal_digits)
+        digits = index > start
+        if index < len(text) and text[index] == '.':
+            after = skip(text, index + 1, decimal_digits)
+            if not digits and after == index + 1:
+                return -1
+            index = after
+            end = exponent_end(text, index, 'eE')
+            if end >= 0:
+                index = end
+        else:
+            index = exponent_end(text, index, 'eE') if digits else -1
+            if index < 0:
+                return -1
+    if index < len(text) and text[index] in 'fFlL':
+        index += 1
+    return index
+
+
+def long_suffix_end(text, index):
+    if text.startswith(('ll', 'LL'), index):
+        return index + 2
+    if index < len(text) and text[index] in 'lL':
+        return index + 1
+    return index
+
+
+def integer_end(text, index):
+    """End of the integer constant starting with a digit at index."""
+    if text.startswith(('0x', '0X'), index) and index + 2 < len(text) and text[index + 2] in hex_digits:
+        index = skip(text, index + 2, hex_digits)
+    elif text[index] == '0':
+        index = skip(text, index + 1, octal_digits)
+    else:
+        index = skip(text, index, decimal_digits)
+
+    if index < len(text) and text[index] in 'uU':
+        return long_suffix_end(text, index + 1)
+    end = long_suffix_end(text, index)
+    if end > index and end < len(text) and text[end] in 'uU':
+        end += 1
+    return end
+
+
+def escape_end(text, index):
+    # end of the escape sequence starting with the backslash at index
+    index += 1
+    if index >= len(text):
+        return -1
+    char = text[index]
+    if char in simple_escapes:
+        return index + 1
+    if char in octal_digits:
+        end = index + 1
+        while end < len(text) and end < index + 3 and text[end] in octal_digits:
+            end += 1
+        return end
+    if char == 'x':
+        end = skip(text, index + 1, hex_digits)
+        return end if end > index + 1 else -1
+    return -1
+
+
+def quoted_end(text, index, quote):
+    """End of the characters and escapes from index up to and including
+    the closing quote, -1 if the line ends first."""
+    length = len(text)
+    while index < length:
+        char = text[index]
+        if char == quote:
+            return index + 1
+        if char == '\n':
+            return -1
+        if char == '\\':
+            index = escape_end(text, index)
+            if index < 0:
+                return -1
+        else:
+            index += 1
+    return -1
+
+
+def string_end(text, index):
+    """End of the string literals, and the blanks after each of them,
+    starting at index (adjacent literals are one token)."""
+    end = -1
+    while True:
+        for prefix in ('u8', 'u', 'U', 'L', ''):
+            if text.startswith(prefix + '"', index):
+                index += len(prefix)
+                break
+        else:
+            return end
+        index = quoted_end(text, index + 1, '"')
+        if index < 0:
+            return end
+        index = end = skip(text, index, string_blanks)
+
+
+def character_end(text, index):
+    if index + 1 < len(text) and text[index + 1] == "'":
+        return -1
+    return quoted_end(text, index + 1, "'")
+
+
+class Scanner:
+    # file being tokenized, for diagnostics
+    path = None
+
+    def __init__(self):
+        self.lineno = 1
+        self.index = 0
+        self.text = None
+
+    def tokenize(self, text, lineno=1, index=0):
+        self.text = text
+        self.lineno = lineno
+        length = len(text)
+        context = DeclarationContext()
+        try:
+            while index < length:
+                char = text[index]
+                code = ord(char)
+                kind = classes[code] if code < 128 else OTHER
+                if kind == BLANK:
+                    index += 1
+                    continue
+                if kind == NEWLINE:
+                    end = skip(text, index, '\n')
+                    lineno += end - index
+                    self.lineno = lineno
+                    index = end
+                    continue
+
+                start = index
+                if kind == NAME:
+                    index = skip(text, index + 1, name_chars)
+                    value = text[start:index]
+                    type_ = keywords.get(value)
+                    if type_ is None:
+                        type_ = context.name_type(value)
+                elif kind == DIGIT or (kind == DOT and start + 1 < length and text[start + 1] in decimal_digits):
+                    index = float_end(text, start)
+                    if index >= 0:
+                        type_ = 'F_CONSTANT'
+                    else:
+                        index = integer_end(text, start)
+                        type_ = 'I_CONSTANT'
+                    value = text[start:index]
+                elif kind == DOUBLE_QUOTE or kind == QUOTE:
+                    if kind == DOUBLE_QUOTE:
+                        index = string_end(text, start)
+                        type_ = 'STRING_LITERAL'
+                    else:
+                        index = character_end(text, start)
+                        type_ = 'I_CONSTANT'
+                    if index < 0:
+                        index = self.error(text, start, lineno)
+                        continue
+                    value = text[start:index]
+                elif kind == SLASH and text.startswith('//', start):
+                    index = text.find('\n', start)
+                    if index < 0:
+                        index = length
+                    continue
+                elif kind == SLASH and text.startswith('/*', start) and text.find('*/', start + 2) >= 0:
+                    index = text.find('*/', start + 2) + 2
+                    lineno += text.count('\n', start, index)
+                    self.lineno = lineno
+                    continue
+                elif kind == OTHER:
+                    index = self.error(text, start, lineno)
+                    continue
+                else:
+                    for value, type_ in operators.get(char, ()):
+                        if text.startswith(value, start):
+                            break
+                    else:
+                        value = type_ = char
+                    index = start + len(value)
+
+                token = Token()
+                token.type = type_
+                token.value = value
+                token.lineno = lineno
+                token.index = start
+                token.end = index
+                context.advance(type_)
+                yield token
+                if type_ == 'STRING_LITERAL':
+                    lineno += value.count('\n')
+                    self.lineno = lineno
+        finally:
+            self.index = index
+            self.lineno = lineno
+
+    def error(self, text, index, lineno):
+        diagnostics.report('error', f'Bad character {text[index]!r}', self.path, lineno)
+        return index + 1
+
+
+def tokens(lexer_class, text):
+    return [(token.type, token.value, token.lineno, token.index, token.end)
+            for token in lexer_class().tokenize(text)]
+
+
+def compare(text):
+    """First (CalcLexer token, Scanner token) that differ, None if the
+    lexers agree on the text."""
+    expected = tokens(CalcLexer, text)
+    found = tokens(Scanner, text)
+    for pair in zip(expected, found):
+        if pair[0] != pair[1]:
+            return pair
+    if len(expected) != len(found):
+        return (expected[len(found):] or [None])[0], (found[len(expected):] or [None])[0]
+    return None
+
+
+def throughput(lexer_class, text, repeat):
+    """Characters per second lexed by the class, the best of `repeat` runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in lexer_class().tokenize(text):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(text) / best if best else float('inf')
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Check the scanner against CalcLexer and time both')
+    arguments.add_argument('paths', nargs='+')
+    arguments.add_argument('--repeat', type=int, default=5)
+    options = arguments.parse_args()
+
+    text = ''
+    failed = False
+    for path in options.paths:
+        source = Path(path).read_text()
+        difference = compare(source)
+        if difference is not None:
+            print(f'{path}: CalcLexer {difference[0]} != Scanner {difference[1]}')
+            failed = True
+        text += source + '\n'
+    diagnostics.clear()
+
+    for lexer_class in (CalcLexer, Scanner):
+        rate = throughput(lexer_class, text, options.repeat)
+        print(f'{lexer_class.__name__}: {rate / 1e6:.2f} M characters/s')
+    sys.exit(1 if failed else 0)
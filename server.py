@@ -0,0 +1,142 @@
+import argparse
+import json
+import socketserver
+import sys
+
+import diagnostics
+import par
+from layout import layout_of
+from output import fragment_text
+
+# Long-running mapper. The grammar tables, lookup and prelude are loaded
+# once and every mapped source is added to one in-memory registry, so
+# layout queries are answered without parsing anything.
+#
+# The protocol is one JSON object per line in both directions:
+#   {"op": "map", "source": "struct a { int x; };", "path": "a.h"} -> {"types": ["a"], "removed": [], "diagnostics": [...]}
+#   {"op": "layout", "name": "a"}                  -> {"name": "a", "type": {...}, "size": 32, ...}
+#   {"op": "types"}                                -> {"types": [...]}
+#   {"op": "signatures"}                           -> {"signatures": [{"returns": ..., "parameters": [...], ...}]}
+#   {"op": "graph", "roots": ["a"]}                -> {"a": {"kind": "struct", "file": ..., "depends_on": [...]}, ...}
+#   {"op": "affected", "names": ["a"]}             -> {"types": [names to rebuild when "a" changes]}
+#   {"op": "reset"}                                -> {}
+# A map lists the types it added or changed, including the types built from
+# them, and the types that are gone. Mapping a path again replaces the
+# definitions of its previous source. Sizes and offsets are in bits.
+# Failures are answered with {"error": "..."}.
+
+
+def start(abi):
+    par.load_size_lookup()
+    par.reset()
+    par.load_prelude(abi)
+
+
+def defined_names():
+    return set(par.simplified_types) | set(par.typedefs)
+
+
+def changed(old, new):
+    return old is not new and fragment_text(old) != fragment_text(new)
+
+
+def handle(request, abi):
+    op = request.get('op')
+    if op == 'map':
+        path = request.get('path')
+        # a source mapped again replaces what it defined before, the types
+        # built from those names are rebuilt (as in watch.Watcher.update)
+        stale = set()
+        if path is not None:
+            stale = {name for name, origin in par.origins.items() if origin == str(path)}
+        previous = dict(par.simplified_types)
+        par.remove_types(stale)
+
+        before = defined_names()
+        diagnostics.clear()
+        par.parse_source(request['source'], path)
+        fresh = defined_names() - before
+        rebuilt = [name for name in par.affected_by(stale | fresh) if name not in fresh]
+        for name in rebuilt:
+            par.resimplify(name)
+
+        names = stale | fresh | set(rebuilt)
+        return {
+            'types': sorted(name for name in names if name in par.simplified_types
+                            and (name not in previous or changed(previous[name], par.simplified_types[name]))),
+            'removed': sorted(name for name in names if name in previous and name not in par.simplified_types),
+            'diagnostics': diagnostics.entries()
+        }
+
+    if op == 'layout':
+        name = request['name']
+        type_desc = par.simplified_types.get(name)
+        if type_desc is None:
+            return {'error': f'Type "{name}" is not defined'}
+        layout = layout_of(type_desc)
+        return {
+            'name': name,
+            'type': type_desc,
+            'size': layout['size'],
+            'align': layout['align'],
+            'offsets': layout['offsets']
+        }
+
+    if op == 'types':
+        return {'types': list(par.simplified_types)}
+
+    if op == 'signatures':
+        return {'signatures': par.signatures}
+
+    if op == 'graph':
+        return par.dependency_graph(request.get('roots'))
+
+    if op == 'affected':
+        return {'types': par.affected_by(request['names'])}
+
+    if op == 'reset':
+        par.reset()
+        par.load_prelude(abi)
+        return {}
+
+    return {'error': f'Unknown operation "{op}"'}
+
+
+def respond(line, abi):
+    try:
+        response = handle(json.loads(line), abi)
+    except Exception as error:
+        response = {'error': f'{type(error).__name__}: {error}'}
+    return json.dumps(response) + '\n'
+
+
+def serve_stdio(abi):
+    for line in sys.stdin:
+        if line.strip():
+            sys.stdout.write(respond(line, abi))
+            sys.stdout.flush()
+
+
+def serve_unix(path, abi):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(respond(line, abi).encode())
+
+    # requests are served one at a time, they share the parser registry
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Serve struct layouts from a warm registry')
+    arguments.add_argument('--abi', default='lp64')
+    arguments.add_argument('--socket', help='Unix socket path (stdin/stdout when omitted)')
+    options = arguments.parse_args()
+
+    start(options.abi)
+    if options.socket:
+        serve_unix(options.socket, options.abi)
+    else:
+        serve_stdio(options.abi)
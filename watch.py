@@ -0,0 +1,119 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import diagnostics
+import par
+from output import FragmentStore
+
+# Keeps a result file up to date while sources are edited. Only changed
+# files are parsed again, then the types depending on what they define are
+# rebuilt from their syntax trees (see par.affected_by) and only the
+# output entries of those types are serialized again. Entries are ordered
+# by type name (see output.dumps).
+
+suffixes = ('.h', '.c')
+
+
+def collect_files(paths):
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(file for file in path.rglob('*') if file.suffix in suffixes))
+        else:
+            files.append(path)
+    return files
+
+
+def defined_names():
+    return set(par.simplified_types) | set(par.typedefs)
+
+
+class Watcher:
+    def __init__(self, paths, output, abi='lp64', fragments=None):
+        self.paths = paths
+        self.output = Path(output)
+        # content-addressed fragment directory, see output.FragmentStore
+        self.store = FragmentStore(fragments) if fragments is not None else None
+        # file -> {'mtime': ..., 'names': names it defines}
+        self.files = {}
+        # type name -> its serialized entry in the output file
+        self.fragments = {}
+
+        par.load_size_lookup()
+        par.reset()
+        par.load_prelude(abi)
+
+    def update(self):
+        """Map changed files and rewrite the output when it changed. Returns
+        the names of the rebuilt types."""
+        current = {}
+        for file in collect_files(self.paths):
+            try:
+                current[file] = file.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+        changed = [file for file in current if file not in self.files or self.files[file]['mtime'] != current[file]]
+        removed = [file for file in self.files if file not in current]
+        if not changed and not removed:
+            return []
+
+        stale = set()
+        for file in changed + removed:
+            if file in self.files:
+                stale |= self.files.pop(file)['names']
+        par.remove_types(stale)
+
+        diagnostics.clear()
+        fresh = set()
+        for file in changed:
+            before = defined_names()
+            par.parse_source(file.read_text(), file)
+            names = defined_names() - before
+            self.files[file] = {'mtime': current[file], 'names': names}
+            fresh |= names
+
+        rebuilt = [name for name in par.affected_by(stale | fresh) if name not in fresh]
+        for name in rebuilt:
+            par.resimplify(name)
+
+        self.write(stale | fresh | set(rebuilt))
+        return sorted(fresh | set(rebuilt))
+
+    def write(self, names):
+        for name in names:
+            if name in par.simplified_types:
+                # the entry exactly as json.dump(..., indent=2) writes it
+                self.fragments[name] = json.dumps({name: par.simplified_types[name]}, indent=2)[2:-2]
+            else:
+                self.fragments.pop(name, None)
+
+        entries = [self.fragments[name] for name in sorted(self.fragments)]
+        text = '{\n' + ',\n'.join(entries) + '\n}' if entries else '{}'
+        if not self.output.exists() or self.output.read_text() != text:
+            self.output.write_text(text)
+        if self.store is not None:
+            self.store.update(par.simplified_types, names, par.signatures)
+
+    def watch(self, interval=0.5):
+        while True:
+            rebuilt = self.update()
+            if rebuilt:
+                print(f'Updated {self.output}: {", ".join(rebuilt)}')
+            diagnostics.render()
+            diagnostics.clear()
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Map C sources again whenever they change')
+    arguments.add_argument('paths', nargs='+', help='source files or directories')
+    arguments.add_argument('--output', default='result.json')
+    arguments.add_argument('--abi', default='lp64')
+    arguments.add_argument('--interval', type=float, default=0.5)
+    arguments.add_argument('--fragments', help='also keep one file per type in this directory')
+    options = arguments.parse_args()
+
+    Watcher(options.paths, options.output, options.abi, options.fragments).watch(options.interval)